@@ -0,0 +1,450 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from .resp import RespClient
+
+# Seconds a conversation is kept after its last request
+CONTEXT_TTL = getattr(settings, 'ASSISTANT_CONTEXT_TTL', 3600)
+# Exchanges kept per conversation, remembered entities and characters kept of each answer
+CONTEXT_TURNS = getattr(settings, 'ASSISTANT_CONTEXT_TURNS', 3)
+CONTEXT_USER_DATA = getattr(settings, 'ASSISTANT_CONTEXT_USER_DATA', 20)
+CONTEXT_RESPONSE_CHARS = getattr(settings, 'ASSISTANT_CONTEXT_RESPONSE_CHARS', 600)
+
+DEFAULT_STORE_SETTINGS = {
+    'BACKEND': 'ai.context_store.CacheContextStore',
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def context_key(ip_address):
+    return f'university_assistant_context_{ip_address}'
+
+
+def summary_key(ip_address):
+    # Written by the summarizer apart from the context, so neither overwrites the other
+    return f'university_assistant_summary_{ip_address}'
+
+
+def new_context():
+    return {
+        'created_at': datetime.now().isoformat(),
+        'conversation_history': deque(maxlen=CONTEXT_TURNS),
+        'user_data': {},
+        # Exchanges so far, and how many of them the summary covers
+        'turns': 0,
+        'summary': '',
+        'summarized': 0,
+    }
+
+
+def make_turn(query, response, intent_data):
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'query': query,
+        'response': response[:CONTEXT_RESPONSE_CHARS],
+        # The entities live in user_data, the name is enough here
+        'intent': (intent_data or {}).get('intent'),
+    }
+
+
+def push_turn(context, turn):
+    """Number and append a turn; the oldest one drops out once CONTEXT_TURNS are kept"""
+    context['turns'] += 1
+    context['conversation_history'].append({**turn, 'number': context['turns']})
+
+
+def remember(context, key, value):
+    """Set a user_data value, forgetting the least recently set ones past CONTEXT_USER_DATA"""
+    user_data = context['user_data']
+    user_data.pop(key, None)
+    user_data[key] = value
+    while len(user_data) > CONTEXT_USER_DATA:
+        del user_data[next(iter(user_data))]
+
+
+def compact_json(value):
+    return json.dumps(value, separators=(',', ':'), default=str)
+
+
+def dumps(context):
+    """Compressed compact JSON of a context (without its summary)"""
+    payload = [
+        context['created_at'], list(context['conversation_history']), context['user_data'], context['turns'],
+    ]
+    return zlib.compress(compact_json(payload).encode('utf-8'))
+
+
+def loads(data, summary=None):
+    """Context from dumps() output and a stored summary, or None for anything else"""
+    if not isinstance(data, bytes):
+        return None
+    try:
+        created_at, history, user_data, turns = json.loads(zlib.decompress(data))
+    except (ValueError, zlib.error):
+        return None
+    return with_summary({
+        'created_at': created_at,
+        'conversation_history': deque(history, maxlen=CONTEXT_TURNS),
+        'user_data': user_data,
+        'turns': turns,
+    }, summary)
+
+
+def with_summary(context, summary):
+    """Attach a stored [summary, summarized, created_at], if it was written for this conversation"""
+    summary, summarized, session = summary or ('', 0, None)
+    if session != context['created_at']:
+        summary, summarized = '', 0
+    context['summary'] = summary
+    context['summarized'] = summarized
+    return context
+
+
+class ContextStore:
+    """
+    Where conversation contexts live, selected by settings.ASSISTANT_CONTEXT_STORE.
+
+    append_turn() records an exchange together with the user_data of the
+    request; stores that can do it atomically never lose an exchange to a
+    concurrent request of the same client. Async methods run the sync ones
+    in a thread unless a store overrides them.
+    """
+
+    def load(self, ip_address):
+        """The stored context of a client, or a new one"""
+        raise NotImplementedError
+
+    def save(self, ip_address, context):
+        raise NotImplementedError
+
+    def append_turn(self, ip_address, context, turn):
+        raise NotImplementedError
+
+    def save_summary(self, ip_address, created_at, summary, summarized):
+        """Store the summary of the first `summarized` exchanges of the conversation started at created_at"""
+        raise NotImplementedError
+
+    def try_lock(self, name, ttl):
+        """Take a lock shared by every process using the store, for ttl seconds at most"""
+        raise NotImplementedError
+
+    def unlock(self, name):
+        raise NotImplementedError
+
+    async def aload(self, ip_address):
+        return await sync_to_async(self.load, thread_sensitive=False)(ip_address)
+
+    async def asave(self, ip_address, context):
+        await sync_to_async(self.save, thread_sensitive=False)(ip_address, context)
+
+    async def aappend_turn(self, ip_address, context, turn):
+        await sync_to_async(self.append_turn, thread_sensitive=False)(ip_address, context, turn)
+
+    async def atry_lock(self, name, ttl):
+        return await sync_to_async(self.try_lock, thread_sensitive=False)(name, ttl)
+
+
+class CacheContextStore(ContextStore):
+    """
+    Contexts in the default Django cache. Shared between processes only when
+    CACHES is, and appending is a read-modify-write: concurrent requests of
+    one client can lose an exchange.
+    """
+
+    def __init__(self, **options):
+        pass
+
+    def load(self, ip_address):
+        keys = (context_key(ip_address), summary_key(ip_address))
+        stored = cache.get_many(keys)
+        return loads(stored.get(keys[0]), stored.get(keys[1])) or new_context()
+
+    def save(self, ip_address, context):
+        cache.set(context_key(ip_address), dumps(context), CONTEXT_TTL)
+
+    def append_turn(self, ip_address, context, turn):
+        # The request's context already holds the turn
+        self.save(ip_address, context)
+
+    def save_summary(self, ip_address, created_at, summary, summarized):
+        cache.set(summary_key(ip_address), [summary, summarized, created_at], CONTEXT_TTL)
+
+    def try_lock(self, name, ttl):
+        return cache.add(f'university_assistant_lock_{name}', True, ttl)
+
+    def unlock(self, name):
+        cache.delete(f'university_assistant_lock_{name}')
+
+    async def aload(self, ip_address):
+        keys = (context_key(ip_address), summary_key(ip_address))
+        stored = await cache.aget_many(keys)
+        return loads(stored.get(keys[0]), stored.get(keys[1])) or new_context()
+
+    async def asave(self, ip_address, context):
+        await cache.aset(context_key(ip_address), dumps(context), CONTEXT_TTL)
+
+    async def aappend_turn(self, ip_address, context, turn):
+        await self.asave(ip_address, context)
+
+    async def atry_lock(self, name, ttl):
+        return await cache.aadd(f'university_assistant_lock_{name}', True, ttl)
+
+
+class SQLiteTransaction:
+    """BEGIN IMMEDIATE ... COMMIT, taking the write lock up front so read-modify-write cycles never interleave"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class SQLiteContextStore(ContextStore):
+    """
+    Contexts in a SQLite file (LOCATION), shared by every process on the host.
+
+    An append reads and rewrites the client's row inside one write
+    transaction, so concurrent appends are serialized. Expired rows are
+    ignored on read and deleted now and then on write.
+    """
+
+    # Share of writes that also delete expired rows
+    PURGE_RATE = 0.01
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS contexts (
+            key TEXT PRIMARY KEY, data BLOB NOT NULL, summary TEXT, expires REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS contexts_expires ON contexts (expires)",
+        "CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, expires REAL NOT NULL)",
+    )
+
+    def __init__(self, location='assistant_context.sqlite3', timeout=5.0, **options):
+        self.location = str(location)
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._transaction() as connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.location, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self):
+        return SQLiteTransaction(self._connection())
+
+    def _read(self, connection, ip_address):
+        row = connection.execute(
+            'SELECT data, summary FROM contexts WHERE key = ? AND expires > ?', (ip_address, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return loads(bytes(row[0]), json.loads(row[1]) if row[1] else None)
+
+    def _write(self, connection, ip_address, context):
+        connection.execute(
+            'INSERT INTO contexts (key, data, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET data = excluded.data, expires = excluded.expires',
+            (ip_address, dumps(context), time.time() + CONTEXT_TTL),
+        )
+        if random.random() < self.PURGE_RATE:
+            connection.execute('DELETE FROM contexts WHERE expires <= ?', (time.time(),))
+
+    def load(self, ip_address):
+        return self._read(self._connection(), ip_address) or new_context()
+
+    def save(self, ip_address, context):
+        with self._transaction() as connection:
+            self._write(connection, ip_address, context)
+
+    def append_turn(self, ip_address, context, turn):
+        with self._transaction() as connection:
+            stored = self._read(connection, ip_address)
+            if stored is None:
+                stored = {**new_context(), 'created_at': context['created_at']}
+            push_turn(stored, turn)
+            for key, value in context['user_data'].items():
+                remember(stored, key, value)
+            self._write(connection, ip_address, stored)
+
+    def save_summary(self, ip_address, created_at, summary, summarized):
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE contexts SET summary = ? WHERE key = ?',
+                (compact_json([summary, summarized, created_at]), ip_address),
+            )
+
+    def try_lock(self, name, ttl):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM locks WHERE name = ? AND expires <= ?', (name, time.time()))
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO locks (name, expires) VALUES (?, ?)', (name, time.time() + ttl)
+            )
+            return cursor.rowcount == 1
+
+    def unlock(self, name):
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM locks WHERE name = ?', (name,))
+
+
+class RedisContextStore(ContextStore):
+    """
+    Contexts on a Redis-protocol server (LOCATION, a redis:// URL), shared by
+    every host. Any server supporting MULTI/EXEC and the list, hash and
+    expiry commands will do.
+
+    A client has a hash (created_at, turn count, user_data, summary) and a
+    capped list of turns. An append is one MULTI/EXEC transaction: push,
+    trim, count and refresh both expiries. user_data is replaced by the
+    request's, so of concurrent requests the last one's entities are kept.
+    """
+
+    def __init__(self, location='redis://localhost:6379/0', timeout=5.0, prefix='assistant', **options):
+        self.client = RespClient(location, timeout=timeout)
+        self.prefix = prefix
+
+    def _keys(self, ip_address):
+        return f'{self.prefix}:context:{ip_address}', f'{self.prefix}:turns:{ip_address}'
+
+    def _expire(self, ip_address):
+        return [('EXPIRE', key, CONTEXT_TTL) for key in self._keys(ip_address)]
+
+    def load(self, ip_address):
+        meta_key, turns_key = self._keys(ip_address)
+        fields, turns = self.client.transaction(('HGETALL', meta_key), ('LRANGE', turns_key, 0, -1))
+        meta = {fields[i].decode('utf-8'): fields[i + 1] for i in range(0, len(fields), 2)}
+        if 'created_at' not in meta:
+            return new_context()
+
+        count = int(meta.get('turns', 0))
+        # Turn numbers follow from the count, both written by the same transaction
+        history = deque(maxlen=CONTEXT_TURNS)
+        for number, turn in enumerate(turns, count - len(turns) + 1):
+            history.append({**json.loads(turn), 'number': number})
+        return with_summary({
+            'created_at': meta['created_at'].decode('utf-8'),
+            'conversation_history': history,
+            'user_data': json.loads(meta.get('user_data', b'{}')),
+            'turns': count,
+        }, json.loads(meta['summary']) if 'summary' in meta else None)
+
+    def save(self, ip_address, context):
+        meta_key, turns_key = self._keys(ip_address)
+        turns = [
+            compact_json({key: value for key, value in turn.items() if key != 'number'})
+            for turn in context['conversation_history']
+        ]
+        commands = [
+            ('DEL', turns_key),
+            ('HSET', meta_key, 'created_at', context['created_at'], 'turns', context['turns'],
+             'user_data', compact_json(context['user_data'])),
+        ]
+        if turns:
+            commands.append(('RPUSH', turns_key, *turns))
+        self.client.transaction(*commands, *self._expire(ip_address))
+
+    def append_turn(self, ip_address, context, turn):
+        meta_key, turns_key = self._keys(ip_address)
+        self.client.transaction(
+            ('HSETNX', meta_key, 'created_at', context['created_at']),
+            ('HINCRBY', meta_key, 'turns', 1),
+            ('HSET', meta_key, 'user_data', compact_json(context['user_data'])),
+            ('RPUSH', turns_key, compact_json(turn)),
+            ('LTRIM', turns_key, -CONTEXT_TURNS, -1),
+            *self._expire(ip_address),
+        )
+
+    def save_summary(self, ip_address, created_at, summary, summarized):
+        meta_key, _ = self._keys(ip_address)
+        # Summaries finish in the background, possibly after the conversation
+        # expired: the key they recreate must expire as well
+        self.client.transaction(
+            ('HSET', meta_key, 'summary', compact_json([summary, summarized, created_at])),
+            *self._expire(ip_address),
+        )
+
+    def try_lock(self, name, ttl):
+        return self.client.execute('SET', f'{self.prefix}:lock:{name}', 1, 'NX', 'EX', int(ttl)) == 'OK'
+
+    def unlock(self, name):
+        self.client.execute('DEL', f'{self.prefix}:lock:{name}')
+
+
+def build_context_store(config=None):
+    """Instantiate the store described by settings.ASSISTANT_CONTEXT_STORE"""
+    config = {**DEFAULT_STORE_SETTINGS, **(config or getattr(settings, 'ASSISTANT_CONTEXT_STORE', {}))}
+    store_class = import_string(config['BACKEND'])
+    options = {key.lower(): value for key, value in config.items() if key != 'BACKEND'}
+    return store_class(**options)
+
+
+def get_context_store():
+    """Return the process wide context store, creating it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = build_context_store()
+    return _store
+
+
+def reset_context_store():
+    global _store
+    _store = None
+
+
+def load_context(ip_address):
+    return get_context_store().load(ip_address)
+
+
+def save_context(ip_address, context):
+    get_context_store().save(ip_address, context)
+
+
+def append_turn(ip_address, context, query, response, intent_data):
+    """Add an exchange to the request's context and record it in the store"""
+    turn = make_turn(query, response, intent_data)
+    push_turn(context, turn)
+    get_context_store().append_turn(ip_address, context, turn)
+
+
+def save_summary(ip_address, created_at, summary, summarized):
+    get_context_store().save_summary(ip_address, created_at, summary, summarized)
+
+
+async def aload_context(ip_address):
+    return await get_context_store().aload(ip_address)
+
+
+async def asave_context(ip_address, context):
+    await get_context_store().asave(ip_address, context)
+
+
+async def aappend_turn(ip_address, context, query, response, intent_data):
+    turn = make_turn(query, response, intent_data)
+    push_turn(context, turn)
+    await get_context_store().aappend_turn(ip_address, context, turn)
@@ -0,0 +1,55 @@
+import math
+import zlib
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+
+from .text import tokenize
+
+EMBEDDING_DIM = getattr(settings, 'ASSISTANT_KB_EMBEDDING_DIM', 512)
+
+# Character trigrams let "enroll" match "enrollment"; they weigh less than words
+NGRAM_WEIGHT = 0.5
+QUESTION_WEIGHT = 2.0
+
+
+def features(text):
+    """Weighted features of text: stemmed words, word pairs and character trigrams"""
+    tokens = tokenize(text)
+    weighted = Counter(tokens)
+    weighted.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+    for token in tokens:
+        padded = f"<{token}>"
+        for start in range(len(padded) - 2):
+            weighted['#' + padded[start:start + 3]] += NGRAM_WEIGHT
+    return weighted
+
+
+def embed(text, dim=EMBEDDING_DIM):
+    """
+    Unit-length float32 vector of text using signed feature hashing.
+
+    Stateless, so entries embedded at different times stay comparable and no
+    model has to be trained or loaded.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature, weight in features(text).items():
+        digest = zlib.crc32(feature.encode('utf-8'))
+        sign = 1.0 if digest & 0x80000000 else -1.0
+        vector[digest % dim] += sign * (1.0 + math.log(weight)) if weight >= 1 else sign * weight
+    return _normalize(vector)
+
+
+def embed_entry(question, answer, dim=EMBEDDING_DIM):
+    return _normalize(QUESTION_WEIGHT * embed(question, dim) + embed(answer, dim))
+
+
+def _normalize(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def embedding_bytes(question, answer):
+    """embed_entry() as stored in KnowledgeBaseEntry.embedding"""
+    return embed_entry(question, answer).tobytes()
@@ -0,0 +1,37 @@
+from django.db import connection
+
+# Created by migration 0003 on SQLite and kept in sync with triggers; since 0009
+# it indexes the question and answer lines of search_terms as separate columns
+FTS_TABLE = 'ai_knowledgebaseentry_fts'
+
+# bm25() weights of the question_terms and answer_terms columns, matching the
+# in-memory index (ai.kb_index.QUESTION_WEIGHT)
+FTS_WEIGHTS = (2.0, 1.0)
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(terms):
+    """FTS5 query matching any of the terms, each quoted so no term is read as syntax"""
+    quoted = ('"' + term.replace('"', '""') + '"' for term in dict.fromkeys(terms))
+    return ' OR '.join(quoted)
+
+
+def fts_search(terms, k=5):
+    """
+    (id, score) pairs of the k entries best matching analyzed terms, best first.
+
+    bm25() is lower for better matches, so the score is its negation.
+    """
+    expression = match_expression(terms)
+    if not expression:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, bm25({FTS_TABLE}, %s, %s) AS rank FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s",
+            [*FTS_WEIGHTS, expression, k],
+        )
+        return [(entry_id, -rank) for entry_id, rank in cursor.fetchall()]
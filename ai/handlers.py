@@ -0,0 +1,455 @@
+import asyncio
+from collections import defaultdict
+from operator import itemgetter
+
+from django.db.models import Q
+
+from university.models import (
+    Department, Faculty, Student, AcademicProgram,
+    Course, Semester, Enrollment, Announcement, Building, Room,
+)
+from .prompt_budget import PROMPT_MAX_ROWS
+
+# Each intent is declared as a HandlerSpec: the model, how entities filter it
+# and the fields of a result row. Specs are compiled once into a QueryPlan that
+# filters, projects only the columns the fields read and serializes the rows.
+RANKS = dict(Faculty.RANK_CHOICES)
+STUDENT_STATUSES = dict(Student.STATUS_CHOICES)
+PROGRAM_TYPES = dict(AcademicProgram.PROGRAM_TYPE_CHOICES)
+DEGREES = dict(AcademicProgram.DEGREE_CHOICES)
+GRADES = dict(Enrollment.GRADE_CHOICES)
+SEASONS = dict(Semester.SEASON_CHOICES)
+LEVELS = dict(Course.LEVEL_CHOICES)
+AUDIENCES = dict(Announcement._meta.get_field('target_audience').choices)
+
+
+def _date(value):
+    return value.strftime("%Y-%m-%d") if value else None
+
+
+def _full_name(first, last):
+    return f"{first or ''} {last or ''}".strip()
+
+
+# Entity filters
+class Contains:
+    """Entity is a case-insensitive substring of any of the fields"""
+
+    def __init__(self, entity, *fields):
+        self.entity = entity
+        self.lookups = tuple(f"{field}__icontains" for field in fields)
+
+    def condition(self, value):
+        query = Q()
+        for lookup in self.lookups:
+            query |= Q(**{lookup: value})
+        return query
+
+
+class Equals:
+    """Entity converted with cast equals the field; unparsable values are ignored"""
+
+    def __init__(self, entity, field, cast=int):
+        self.entity = entity
+        self.field = field
+        self.cast = cast
+
+    def condition(self, value):
+        try:
+            return Q(**{self.field: self.cast(value)})
+        except (TypeError, ValueError):
+            return None
+
+
+class Near:
+    """Entity converted with cast is within tolerance of the field"""
+
+    def __init__(self, entity, field, tolerance, cast=float):
+        self.entity = entity
+        self.lower = f"{field}__gte"
+        self.upper = f"{field}__lte"
+        self.tolerance = tolerance
+        self.cast = cast
+
+    def condition(self, value):
+        try:
+            value = self.cast(value)
+        except (TypeError, ValueError):
+            return None
+        return Q(**{self.lower: value - self.tolerance, self.upper: value + self.tolerance})
+
+
+class Present:
+    """Fixed lookups applied whenever the entity is present, whatever its value"""
+
+    def __init__(self, entity, **lookups):
+        self.entity = entity
+        self.query = Q(**lookups)
+
+    def condition(self, value):
+        return self.query
+
+
+# Output fields
+class Field:
+    """Output value read from one or more projected columns"""
+
+    def __init__(self, *columns, convert=None):
+        self.columns = columns
+        self.convert = convert
+
+    def getter(self):
+        if self.convert is None:
+            return itemgetter(self.columns[0])
+        convert = self.convert
+        if len(self.columns) == 1:
+            column = self.columns[0]
+            return lambda row: convert(row[column])
+        columns = itemgetter(*self.columns)
+        return lambda row: convert(*columns(row))
+
+
+class Related:
+    """Values of a many-to-many relation, fetched for every row in one query"""
+
+    def __init__(self, relation, column):
+        self.relation = relation
+        self.column = column
+        self.columns = ('pk',)
+
+    def bind(self, model):
+        field = model._meta.get_field(self.relation)
+        self.through = field.remote_field.through
+        self.owner = f"{field.m2m_field_name()}_id"
+        self.value = f"{field.m2m_reverse_field_name()}__{self.column}"
+
+    def values(self, pks):
+        return self.through._default_manager.filter(**{f"{self.owner}__in": pks}).values_list(self.owner, self.value)
+
+    def getter(self):
+        return itemgetter(self.relation)
+
+
+def choice(column, choices):
+    return Field(column, convert=lambda value: choices.get(value, value) if value else None)
+
+
+def date(column):
+    return Field(column, convert=_date)
+
+
+def full_name(prefix, optional=None):
+    """Full name of the user at prefix; None when the optional relation is empty"""
+    names = (f"{prefix}first_name", f"{prefix}last_name")
+    if optional is None:
+        return Field(*names, convert=_full_name)
+    return Field(optional, *names, convert=lambda present, first, last: _full_name(first, last) if present else None)
+
+
+class HandlerSpec:
+    def __init__(self, model, template, filters, fields, ordering=()):
+        self.model = model
+        self.template = template
+        self.filters = filters
+        self.fields = fields
+        self.ordering = ordering
+
+
+class QueryPlan:
+    """A HandlerSpec compiled into a query builder, a projection and a serializer"""
+
+    def __init__(self, spec):
+        self.template = spec.template
+        self.manager = spec.model._default_manager
+        self.ordering = tuple(spec.ordering)
+        self.filters = tuple(spec.filters)
+        self.related = [field for field in spec.fields.values() if isinstance(field, Related)]
+        for field in self.related:
+            field.bind(spec.model)
+
+        columns = []
+        for field in spec.fields.values():
+            columns.extend(column for column in field.columns if column not in columns)
+        self.columns = tuple(columns)
+        self.getters = tuple((key, field.getter()) for key, field in spec.fields.items())
+
+    def build_query(self, entities):
+        """Filtered queryset for entities, before projection and slicing"""
+        conditions = []
+        for entity_filter in self.filters:
+            if entity_filter.entity in entities:
+                condition = entity_filter.condition(entities[entity_filter.entity])
+                if condition is not None:
+                    conditions.append(condition)
+        queryset = self.manager.filter(*conditions)
+        return queryset.order_by(*self.ordering) if self.ordering else queryset
+
+    def project(self, queryset):
+        return queryset.values(*self.columns)
+
+    def serialize(self, row):
+        return {key: getter(row) for key, getter in self.getters}
+
+    def _attach(self, rows, field, pairs):
+        values = defaultdict(list)
+        for pk, value in pairs:
+            values[pk].append(value)
+        for row in rows:
+            row[field.relation] = values.get(row['pk'], [])
+
+    def fetch(self, entities, limit):
+        """Return (serialized rows, total matches) for at most limit rows"""
+        queryset = self.build_query(entities)
+        rows = list(self.project(queryset)[:limit])
+        if rows:
+            for field in self.related:
+                self._attach(rows, field, field.values([row['pk'] for row in rows]))
+        total = queryset.count() if len(rows) == limit else len(rows)
+        return [self.serialize(row) for row in rows], total
+
+    async def afetch(self, entities, limit):
+        queryset = self.build_query(entities)
+        rows = [row async for row in self.project(queryset)[:limit]]
+        if rows:
+            for field in self.related:
+                pairs = [pair async for pair in field.values([row['pk'] for row in rows])]
+                self._attach(rows, field, pairs)
+        total = await queryset.acount() if len(rows) == limit else len(rows)
+        return [self.serialize(row) for row in rows], total
+
+
+HANDLER_SPECS = {
+    'department_info': HandlerSpec(
+        Department, "Here's information about the department(s):",
+        filters=[
+            Contains('department', 'name', 'code', 'description', 'location'),
+            Contains('head_of_department', 'head_of_department__user__first_name',
+                     'head_of_department__user__last_name'),
+        ],
+        fields={
+            'name': Field('name'),
+            'code': Field('code'),
+            'description': Field('description'),
+            'location': Field('location'),
+            'contact': Field('contact_email'),
+            'website': Field('website'),
+            'head': full_name('head_of_department__user__', optional='head_of_department'),
+            'established_date': date('established_date'),
+        },
+    ),
+    'faculty_info': HandlerSpec(
+        Faculty, "Here are faculty members matching your query:",
+        filters=[
+            Contains('faculty_name', 'user__first_name', 'user__last_name', 'user__username'),
+            Contains('department', 'department__name', 'department__code'),
+            Contains('rank', 'rank'),
+            Contains('research', 'research_interests'),
+        ],
+        fields={
+            'name': full_name('user__'),
+            'title': choice('rank', RANKS),
+            'department': Field('department__name'),
+            'office': Field('office_location'),
+            'phone': Field('phone'),
+            'email': Field('user__email'),
+            'research': Field('research_interests'),
+            'office_hours': Field('office_hours'),
+            'hire_date': date('hire_date'),
+        },
+    ),
+    'student_info': HandlerSpec(
+        Student, "Here are students matching your query:",
+        filters=[
+            Contains('student_name', 'user__first_name', 'user__last_name', 'user__username'),
+            Contains('student_id', 'student_id'),
+            Contains('status', 'status'),
+            Near('gpa', 'gpa', 0.2),
+            Contains('program', 'current_program__name', 'current_program__code'),
+        ],
+        fields={
+            'name': full_name('user__'),
+            'student_id': Field('student_id'),
+            'email': Field('user__email'),
+            'program': Field('current_program__name'),
+            'status': choice('status', STUDENT_STATUSES),
+            'gpa': Field('gpa'),
+            'advisor': full_name('advisor__user__', optional='advisor'),
+            'admission_date': date('admission_date'),
+            'expected_graduation': date('expected_graduation'),
+        },
+    ),
+    'program_info': HandlerSpec(
+        AcademicProgram, "Here are academic programs matching your query:",
+        filters=[
+            Contains('program_type', 'program_type', 'degree'),
+            Contains('department', 'department__name', 'department__code'),
+            Contains('degree', 'degree'),
+            Equals('credits', 'total_credits_required'),
+        ],
+        fields={
+            'name': Field('name'),
+            'type': choice('program_type', PROGRAM_TYPES),
+            'degree': choice('degree', DEGREES),
+            'department': Field('department__name'),
+            'credits': Field('total_credits_required'),
+            'duration': Field('duration_years', convert="{} years".format),
+            'description': Field('description'),
+            'code': Field('code'),
+        },
+    ),
+    'course_info': HandlerSpec(
+        Course, "Here are courses matching your query:",
+        filters=[
+            Contains('course_level', 'level'),
+            Contains('department', 'department__name', 'department__code'),
+            Contains('course_code', 'code'),
+            Contains('course_title', 'title'),
+            Equals('credits', 'credits'),
+        ],
+        fields={
+            'code': Field('code'),
+            'title': Field('title'),
+            'department': Field('department__name'),
+            'level': choice('level', LEVELS),
+            'credits': Field('credits'),
+            'description': Field('description'),
+            'is_core': Field('is_core'),
+            'prerequisites': Related('prerequisites', 'code'),
+        },
+    ),
+    'enrollment_info': HandlerSpec(
+        Enrollment, "Here are enrollment records matching your query:",
+        filters=[
+            Contains('student', 'student__user__first_name', 'student__user__last_name', 'student__student_id'),
+            Contains('course', 'course_offering__course__title', 'course_offering__course__code'),
+            Contains('semester', 'course_offering__semester__name', 'course_offering__semester__code'),
+            Contains('grade', 'grade'),
+        ],
+        fields={
+            'student': full_name('student__user__'),
+            'student_id': Field('student__student_id'),
+            'course': Field('course_offering__course__title'),
+            'course_code': Field('course_offering__course__code'),
+            'semester': Field(
+                'course_offering__semester__season', 'course_offering__semester__year',
+                convert=lambda season, year: f"{SEASONS.get(season)} {year}",
+            ),
+            'grade': choice('grade', GRADES),
+            'status': Field('status'),
+            'enrollment_date': date('enrollment_date'),
+        },
+    ),
+    'building_info': HandlerSpec(
+        Building, "Here are campus buildings matching your query:",
+        filters=[
+            Contains('building', 'name', 'code', 'location'),
+        ],
+        fields={
+            'name': Field('name'),
+            'code': Field('code'),
+            'location': Field('location'),
+            'description': Field('description'),
+        },
+    ),
+    'room_info': HandlerSpec(
+        Room, "Here are rooms matching your query:",
+        filters=[
+            Contains('room', 'room_number', 'building__name', 'building__code'),
+            Contains('room_type', 'room_type'),
+            Near('capacity', 'capacity', 5, cast=int),
+        ],
+        fields={
+            'building': Field('building__name'),
+            'building_code': Field('building__code'),
+            'room_number': Field('room_number'),
+            'type': Field('room_type'),
+            'capacity': Field('capacity'),
+            'features': Field('features'),
+        },
+    ),
+    'announcement': HandlerSpec(
+        Announcement, "Here are recent university announcements:",
+        filters=[
+            Present('urgency', is_urgent=True),
+            Contains('announcement_title', 'title'),
+            Contains('target', 'target_audience'),
+        ],
+        fields={
+            'title': Field('title'),
+            'content': Field('content'),
+            'author': full_name('author__', optional='author'),
+            'date': date('publish_date'),
+            'is_urgent': Field('is_urgent'),
+            'target': choice('target_audience', AUDIENCES),
+        },
+        ordering=('-publish_date',),
+    ),
+}
+
+# intent -> compiled QueryPlan, built once at import
+INTENT_HANDLERS = {intent: QueryPlan(spec) for intent, spec in HANDLER_SPECS.items()}
+
+GENERAL_INFO_TEMPLATE = "Here's general information about the university:"
+
+
+# General University Information
+def general_info():
+    return {
+        'departments_count': Department.objects.count(),
+        'faculty_count': Faculty.objects.count(),
+        'programs_count': AcademicProgram.objects.count(),
+        'active_students': Student.objects.filter(status='A').count(),
+        'current_semester': str(Semester.objects.filter(is_current=True).first()),
+        'total_courses': Course.objects.count(),
+        'total_buildings': Building.objects.count()
+    }
+
+
+async def ageneral_info():
+    counts = await asyncio.gather(
+        Department.objects.acount(),
+        Faculty.objects.acount(),
+        AcademicProgram.objects.acount(),
+        Student.objects.filter(status='A').acount(),
+        Semester.objects.filter(is_current=True).afirst(),
+        Course.objects.acount(),
+        Building.objects.acount(),
+    )
+    keys = ['departments_count', 'faculty_count', 'programs_count', 'active_students',
+            'current_semester', 'total_courses', 'total_buildings']
+    result = dict(zip(keys, counts))
+    result['current_semester'] = str(result['current_semester'])
+    return result
+
+
+def result_limit(intent):
+    """Rows worth fetching for an intent: as many as the answer prompt uses"""
+    return PROMPT_MAX_ROWS.get(intent, PROMPT_MAX_ROWS['default'])
+
+
+def fetch_intent_data(intent_data):
+    """
+    Run the handler for the detected intent.
+
+    Returns (result_data, response_template, total_results). Only the first
+    result_limit() rows are fetched; the total comes from a separate COUNT query
+    when there may be more.
+    """
+    intent = intent_data.get('intent')
+    handler = INTENT_HANDLERS.get(intent)
+    if handler is None:
+        return general_info(), GENERAL_INFO_TEMPLATE, None
+
+    rows, total = handler.fetch(intent_data.get('entities') or {}, result_limit(intent))
+    return rows, handler.template, total
+
+
+async def afetch_intent_data(intent_data):
+    """Async variant of fetch_intent_data() using async ORM iteration"""
+    intent = intent_data.get('intent')
+    handler = INTENT_HANDLERS.get(intent)
+    if handler is None:
+        return await ageneral_info(), GENERAL_INFO_TEMPLATE, None
+
+    rows, total = await handler.afetch(intent_data.get('entities') or {}, result_limit(intent))
+    return rows, handler.template, total
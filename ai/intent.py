@@ -0,0 +1,349 @@
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from university.models import AcademicProgram, Building, Course, Department, Faculty
+from .handlers import HANDLER_SPECS
+from .text import STOPWORDS
+from .trigram import TrigramIndex
+
+# Confidence above which the local classifier answers without asking Gemini
+LOCAL_INTENT_THRESHOLD = getattr(settings, 'ASSISTANT_LOCAL_INTENT_THRESHOLD', 0.7)
+
+# How long (seconds) the gazetteer built from university tables is reused
+GAZETTEER_TTL = getattr(settings, 'ASSISTANT_GAZETTEER_TTL', 300)
+
+# Trigram (Dice) similarity a misspelled name needs to count as an entity
+ENTITY_FUZZY_THRESHOLD = getattr(settings, 'ASSISTANT_ENTITY_FUZZY_THRESHOLD', 0.6)
+# Closest names checked for one whose numbers match the query's
+FUZZY_CANDIDATES = 5
+
+# Keyword cues for each intent as (phrase, weight)
+INTENT_RULES = {
+    'building_info': [
+        ('where is', 0.5), ('building', 1.0), ('buildings', 1.0), ('located', 0.5),
+        ('location of', 0.5), ('hall', 0.5), ('directions to', 1.0), ('campus map', 1.0),
+    ],
+    'room_info': [
+        ('room', 1.0), ('rooms', 1.0), ('classroom', 1.0), ('lab', 0.5),
+        ('capacity', 0.5), ('seats', 0.5),
+    ],
+    'faculty_info': [
+        ('who teaches', 2.0), ('professor', 1.0), ('prof', 1.0), ('instructor', 1.0),
+        ('faculty', 1.0), ('lecturer', 1.0), ('dr', 0.5), ('office hours', 1.0),
+        ('research', 0.5), ('teacher', 1.0),
+    ],
+    'course_info': [
+        ('course', 1.0), ('courses', 1.0), ('class', 0.5), ('classes', 0.5),
+        ('prerequisite', 1.0), ('prerequisites', 1.0), ('prereq', 1.0), ('prereqs', 1.0),
+        ('syllabus', 1.0), ('credit hours', 0.5),
+    ],
+    'department_info': [
+        ('department', 1.0), ('departments', 1.0), ('dept', 1.0), ('head of', 0.5),
+        ('chair', 0.5),
+    ],
+    'program_info': [
+        ('program', 1.0), ('programs', 1.0), ('major', 1.0), ('majors', 1.0),
+        ('minor', 1.0), ('degree', 1.0), ('degrees', 1.0), ('certificate', 1.0),
+        ('bachelor', 1.0), ('master', 1.0), ('masters', 1.0), ('phd', 0.5),
+    ],
+    'student_info': [
+        ('student', 0.5), ('students', 0.5), ('gpa', 1.0), ('student id', 1.5),
+        ('advisor', 0.5), ('graduation', 0.5),
+    ],
+    'enrollment_info': [
+        ('enrolled', 1.0), ('enrollment', 1.0), ('enrollments', 1.0), ('enroll', 0.5),
+        ('grade', 1.0), ('grades', 1.0), ('registered', 0.5),
+    ],
+    'announcement': [
+        ('announcement', 1.5), ('announcements', 1.5), ('news', 1.0), ('urgent', 0.5),
+        ('notice', 1.0), ('notices', 1.0),
+    ],
+}
+
+# How much a gazetteer hit for an entity supports each intent; it only counts
+# when that intent's handler can filter on the entity (see filterable())
+ENTITY_SUPPORT = {
+    'department': {'department_info': 0.5, 'faculty_info': 0.25, 'program_info': 0.25, 'course_info': 0.25},
+    'course_code': {'course_info': 1.0, 'faculty_info': 0.5, 'enrollment_info': 0.25},
+    'course_title': {'course_info': 0.5, 'enrollment_info': 0.25},
+    'building': {'building_info': 1.0, 'room_info': 0.5},
+    'faculty_name': {'faculty_info': 1.0},
+    'program': {'program_info': 0.5, 'student_info': 0.25},
+}
+
+INTENT_NAMES = tuple(INTENT_RULES) + ('other',)
+
+# Entity keys that the handlers in views.py expect under a different name
+ENTITY_ALIASES = {
+    'room_info': {'building': 'room'},
+    'enrollment_info': {'course_code': 'course', 'course_title': 'course'},
+}
+
+# Entities each intent's handler filters on, under the handler's names
+HANDLER_ENTITIES = {
+    intent: {spec_filter.entity for spec_filter in spec.filters} for intent, spec in HANDLER_SPECS.items()
+}
+
+# Confidence at most, when no entity narrows the winning intent's rows: an
+# unfiltered handler would answer with arbitrary rows, so Gemini decides
+UNFILTERED_CONFIDENCE = LOCAL_INTENT_THRESHOLD / 2
+
+_RULE_PATTERNS = {
+    intent: [(re.compile(r'\b' + re.escape(phrase) + r'\b'), weight) for phrase, weight in rules]
+    for intent, rules in INTENT_RULES.items()
+}
+_COURSE_CODE_RE = re.compile(r'\b([A-Z]{2,4})[\s-]?(\d{3,4})\b', re.IGNORECASE)
+_TITLED_NAME_RE = re.compile(r'\b(?:dr|prof|professor)\.?\s+([a-z][a-z\'-]+)')
+_COURSE_LEVEL_RE = re.compile(r'\b([1-7]00)[\s-]?level\b')
+_CREDITS_RE = re.compile(r'\b(\d{1,3})\s+credits?\b')
+_GPA_RE = re.compile(r'\bgpa\s+(?:of\s+|above\s+|around\s+)?([0-4](?:\.\d+)?)\b')
+_STUDENT_ID_RE = re.compile(r'\b(\d{7,10})\b')
+_WORD_RE = re.compile(r'[a-z0-9]+')
+_NUMBER_RE = re.compile(r'\d+')
+_KEYWORD_RE = re.compile(r"[a-z0-9][a-z0-9'-]*")
+
+_gazetteer = None
+_gazetteer_built_at = 0
+_gazetteer_lock = threading.Lock()
+
+
+def _normalize(text):
+    """Lowercase text and collapse it to space separated alphanumeric tokens"""
+    return ' '.join(_WORD_RE.findall(text.lower()))
+
+
+def _compact_code(code):
+    """Canonical form of a course code used for lookups (e.g. 'CS 2250' -> 'cs2250')"""
+    return re.sub(r'[\s-]', '', code.lower())
+
+
+def build_gazetteer():
+    """Build name lookups for the entities the assistant can filter on"""
+    names = {}
+    longest = 1
+
+    def add(name, kind, value):
+        nonlocal longest
+        key = _normalize(name or '')
+        # Skip very short keys, they collide with ordinary words
+        if len(key) < 4:
+            return
+        names.setdefault(key, (kind, value))
+        longest = max(longest, key.count(' ') + 1)
+
+    # Short codes are only trusted when typed in upper case (e.g. "CS", "BIO")
+    codes = {}
+    course_codes = {}
+    last_names = {}
+
+    for name, code in Department.objects.values_list('name', 'code'):
+        add(name, 'department', name)
+        stripped = re.sub(r'^(department|dept|school|college) of\s+', '', name, flags=re.IGNORECASE)
+        add(stripped, 'department', name)
+        codes[code] = ('department', code)
+
+    for name, code in AcademicProgram.objects.values_list('name', 'code'):
+        add(name, 'program', name)
+        codes[code] = ('program', code)
+
+    for name, code in Building.objects.values_list('name', 'code'):
+        add(name, 'building', name)
+        codes[code] = ('building', code)
+
+    for first, last in Faculty.objects.values_list('user__first_name', 'user__last_name'):
+        if first and last:
+            add(f"{first} {last}", 'faculty_name', f"{first} {last}")
+        if last:
+            last_names[last.lower()] = last
+
+    for code, title in Course.objects.values_list('code', 'title'):
+        course_codes[_compact_code(code)] = code
+        add(title, 'course_title', title)
+
+    return {
+        'names': names,
+        'fuzzy': {
+            size: TrigramIndex((key, key) for key in names if key.count(' ') + 1 == size)
+            for size in range(1, longest + 1)
+        },
+        'longest': longest,
+        'codes': codes,
+        'course_codes': course_codes,
+        'last_names': last_names,
+    }
+
+
+def get_gazetteer():
+    """Return the cached gazetteer, rebuilding it once GAZETTEER_TTL has passed"""
+    global _gazetteer, _gazetteer_built_at
+    if _gazetteer is None or time.monotonic() - _gazetteer_built_at > GAZETTEER_TTL:
+        with _gazetteer_lock:
+            if _gazetteer is None or time.monotonic() - _gazetteer_built_at > GAZETTEER_TTL:
+                _gazetteer = build_gazetteer()
+                _gazetteer_built_at = time.monotonic()
+    return _gazetteer
+
+
+def reset_gazetteer():
+    """Drop the cached gazetteer so the next lookup reloads it"""
+    global _gazetteer
+    _gazetteer = None
+
+
+def fuzzy_name(tokens, gazetteer):
+    """
+    Closest gazetteer name with as many words as a short window of the query, for misspellings.
+
+    Numbers must match exactly: "Hall 99" is not a misspelling of "Hall 9",
+    nor "C0003 course" of "Course 0".
+    """
+    best_score, best = 0.0, None
+    for size in range(1, min(gazetteer['longest'], 3) + 1):
+        for start in range(len(tokens) - size + 1):
+            window = tokens[start:start + size]
+            if window[0] in STOPWORDS or window[-1] in STOPWORDS or len(''.join(window)) < 4:
+                continue
+            text = ' '.join(window)
+            numbers = _NUMBER_RE.findall(text)
+            index = gazetteer['fuzzy'][size]
+            for key, score in index.search(text, k=FUZZY_CANDIDATES, threshold=ENTITY_FUZZY_THRESHOLD):
+                if score > best_score and _NUMBER_RE.findall(key) == numbers:
+                    best_score, best = score, gazetteer['names'][key]
+                    break
+    return best
+
+
+def extract_entities(user_query, gazetteer):
+    """Find known university entities and simple numeric attributes in the query"""
+    entities = {}
+    text = _normalize(user_query)
+    lowered = user_query.lower()
+
+    # Course codes such as "CS 2250" or "cs-2250"
+    for prefix, number in _COURSE_CODE_RE.findall(user_query):
+        compact = f"{prefix}{number}".lower()
+        if compact in gazetteer['course_codes']:
+            entities['course_code'] = gazetteer['course_codes'][compact]
+            break
+        if prefix.isupper():
+            entities['course_code'] = f"{prefix}{number}"
+            break
+
+    # Longest gazetteer name first, without overlapping matches
+    tokens = text.split()
+    used = [False] * len(tokens)
+    for size in range(min(gazetteer['longest'], len(tokens)), 0, -1):
+        for start in range(len(tokens) - size + 1):
+            if any(used[start:start + size]):
+                continue
+            match = gazetteer['names'].get(' '.join(tokens[start:start + size]))
+            if match and match[0] not in entities:
+                entities[match[0]] = match[1]
+                used[start:start + size] = [True] * size
+
+    if not any(used):
+        match = fuzzy_name(tokens, gazetteer)
+        if match:
+            entities.setdefault(*match)
+
+    # Course codes were handled above, so their prefixes are not department codes
+    for token in re.findall(r'\b[A-Z]{2,10}\b', _COURSE_CODE_RE.sub(' ', user_query)):
+        if token in gazetteer['codes']:
+            kind, value = gazetteer['codes'][token]
+            entities.setdefault(kind, value)
+
+    titled = _TITLED_NAME_RE.search(lowered)
+    if titled and titled.group(1) in gazetteer['last_names']:
+        entities.setdefault('faculty_name', gazetteer['last_names'][titled.group(1)])
+
+    level = _COURSE_LEVEL_RE.search(lowered)
+    if level:
+        entities['course_level'] = level.group(1)
+
+    credits = _CREDITS_RE.search(lowered)
+    if credits:
+        entities['credits'] = credits.group(1)
+
+    gpa = _GPA_RE.search(lowered)
+    if gpa:
+        entities['gpa'] = gpa.group(1)
+
+    student_id = _STUDENT_ID_RE.search(lowered)
+    if student_id and 'student' in lowered:
+        entities['student_id'] = student_id.group(1)
+
+    return entities
+
+
+def filterable(intent, entity):
+    """Whether the handler of intent can filter its rows on entity"""
+    return ENTITY_ALIASES.get(intent, {}).get(entity, entity) in HANDLER_ENTITIES.get(intent, ())
+
+
+def score_intents(user_query, entities):
+    """Score every intent from keyword cues and the entities found in the query"""
+    text = _normalize(user_query)
+    scores = dict.fromkeys(INTENT_RULES, 0.0)
+
+    for intent, patterns in _RULE_PATTERNS.items():
+        for pattern, weight in patterns:
+            if pattern.search(text):
+                scores[intent] += weight
+
+    for entity in entities:
+        for intent, weight in ENTITY_SUPPORT.get(entity, {}).items():
+            if filterable(intent, entity):
+                scores[intent] += weight
+
+    if 'student_id' in entities or 'gpa' in entities:
+        scores['student_info'] += 1.0
+    if 'course_level' in entities:
+        scores['course_info'] += 0.5
+
+    return scores
+
+
+def extract_keywords(user_query, limit=5):
+    """Knowledge base search keywords taken straight from the query"""
+    keywords = []
+    for word in _KEYWORD_RE.findall(user_query.lower()):
+        if len(word) > 2 and word not in STOPWORDS and word not in keywords:
+            keywords.append(word)
+    return keywords[:limit]
+
+
+def classify_intent(user_query):
+    """
+    Classify a query locally using keyword rules and the university gazetteer.
+
+    Returns a tuple of (intent_data, confidence) where intent_data has the same
+    shape as parse_gemini_response() and confidence is between 0 and 1.
+    """
+    entities = extract_entities(user_query, get_gazetteer())
+    scores = score_intents(user_query, entities)
+    keywords = extract_keywords(user_query)
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (intent, top), (_, runner_up) = ranked[0], ranked[1]
+    if top <= 0:
+        return {"intent": "other", "entities": entities, "requires_followup": False, "keywords": keywords}, 0.0
+
+    # Confidence grows with the evidence for the winner and shrinks with ambiguity
+    confidence = min(1.0, top / 1.5) * (top / (top + runner_up))
+    if not any(filterable(intent, entity) for entity in entities):
+        confidence = min(confidence, UNFILTERED_CONFIDENCE)
+
+    for key, alias in ENTITY_ALIASES.get(intent, {}).items():
+        if key in entities:
+            entities.setdefault(alias, entities.pop(key))
+
+    intent_data = {
+        "intent": intent,
+        "entities": entities,
+        "requires_followup": not entities,
+        "keywords": keywords,
+    }
+    return intent_data, round(confidence, 3)
@@ -0,0 +1,36 @@
+from urllib.parse import quote_plus
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Seconds search results are cached; searches that found nothing expire sooner
+KB_CACHE_TTL = getattr(settings, 'ASSISTANT_KB_CACHE_TTL', 3600)
+KB_NEGATIVE_CACHE_TTL = getattr(settings, 'ASSISTANT_KB_NEGATIVE_CACHE_TTL', 60)
+
+# Part of every result key; bumping it makes all cached results unreachable
+VERSION_KEY = 'kb_search_version'
+
+
+def kb_cache_version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+async def akb_cache_version():
+    return await cache.aget_or_set(VERSION_KEY, 1, None)
+
+
+def kb_cache_key(query, version):
+    # Safe cache key using quote_plus to avoid Memcached issues
+    return f"kb_search_{version}_{quote_plus(query.lower())}"
+
+
+def kb_cache_timeout(results):
+    return KB_CACHE_TTL if results else KB_NEGATIVE_CACHE_TTL
+
+
+def invalidate_kb_cache():
+    """Drop every cached knowledge base search (stale keys expire on their own)"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 2, None)
@@ -0,0 +1,174 @@
+import heapq
+import logging
+import math
+import time
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+from django.conf import settings
+
+from .kb_sync import LiveIndex
+from .models import KnowledgeBaseEntry
+from .trigram import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+KB_BM25_K1 = getattr(settings, 'ASSISTANT_KB_BM25_K1', 1.5)
+KB_BM25_B = getattr(settings, 'ASSISTANT_KB_BM25_B', 0.75)
+
+# Question tokens count this many times, so a match in the question outranks one in the answer
+QUESTION_WEIGHT = 2
+
+class BM25Index:
+    """
+    Inverted index with Okapi BM25 scoring.
+
+    Documents are (doc_id, tokens) pairs. Each term maps to a posting list of
+    (document position, term frequency), so a search only touches the
+    documents containing one of the query terms. Documents can be added and
+    removed after the build; posting lists are replaced rather than modified,
+    so a search running meanwhile never sees a half updated list.
+    """
+
+    def __init__(self, k1=KB_BM25_K1, b=KB_BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []
+        self.lengths = []
+        # Terms of each document, to find its postings again when it is removed
+        self.doc_terms = []
+        self.positions = {}
+        self.postings = {}
+        self.total_length = 0
+
+    def build(self, documents):
+        postings = defaultdict(list)
+        for doc_id, tokens in documents:
+            counts = Counter(tokens)
+            position = self._place(doc_id, len(tokens), tuple(counts))
+            for term, frequency in counts.items():
+                postings[term].append((position, frequency))
+        self.postings = {term: tuple(docs) for term, docs in postings.items()}
+        return self
+
+    def _place(self, doc_id, length, terms):
+        position = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.lengths.append(length)
+        self.doc_terms.append(terms)
+        self.positions[doc_id] = position
+        self.total_length += length
+        return position
+
+    def add(self, doc_id, tokens):
+        """Index a new document, or re-index one that changed"""
+        self.remove(doc_id)
+        counts = Counter(tokens)
+        position = self._place(doc_id, len(tokens), tuple(counts))
+        for term, frequency in counts.items():
+            self.postings[term] = self.postings.get(term, ()) + ((position, frequency),)
+
+    def remove(self, doc_id):
+        position = self.positions.pop(doc_id, None)
+        if position is None:
+            return
+        for term in self.doc_terms[position]:
+            docs = tuple(posting for posting in self.postings[term] if posting[0] != position)
+            if docs:
+                self.postings[term] = docs
+            else:
+                del self.postings[term]
+        # The position stays empty until the next full build
+        self.total_length -= self.lengths[position]
+        self.doc_ids[position] = None
+        self.lengths[position] = 0
+        self.doc_terms[position] = ()
+
+    def search(self, tokens, k=5):
+        """Return up to k (doc_id, score) pairs, best first"""
+        count = len(self.positions)
+        if not count:
+            return []
+        scores = defaultdict(float)
+        k1 = self.k1 + 1
+        # Length normalisation k1 * (1 - b + b * length / average length), as base + scale * length
+        base = self.k1 * (1 - self.b)
+        scale = self.k1 * self.b * count / self.total_length if self.total_length else 0.0
+        lengths = self.lengths
+        for term in set(tokens):
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for position, frequency in docs:
+                scores[position] += idf * frequency * k1 / (frequency + base + scale * lengths[position])
+        best = heapq.nlargest(k, scores.items(), key=itemgetter(1))
+        return [(self.doc_ids[position], score) for position, score in best if self.doc_ids[position] is not None]
+
+    def __len__(self):
+        return len(self.positions)
+
+
+def entry_tokens(search_terms):
+    """Index tokens of stored search terms (question terms on the first line)"""
+    question, _, answer = (search_terms or '').partition('\n')
+    return question.split() * QUESTION_WEIGHT + answer.split()
+
+
+def build_kb_index():
+    """Index the search terms of every KnowledgeBaseEntry (one query, streamed)"""
+    started = time.perf_counter()
+    rows = KnowledgeBaseEntry.objects.values_list('id', 'search_terms').iterator()
+    index = BM25Index().build((entry_id, entry_tokens(search_terms)) for entry_id, search_terms in rows)
+    logger.info("KB index: %d entries, %d terms in %.0f ms",
+                len(index), len(index.postings), (time.perf_counter() - started) * 1000)
+    return index
+
+
+def update_kb_index(index, entry_ids):
+    """Re-index the given entries, dropping the deleted ones, with one query"""
+    rows = dict(KnowledgeBaseEntry.objects.filter(id__in=entry_ids).values_list('id', 'search_terms'))
+    for entry_id in entry_ids:
+        if entry_id in rows:
+            index.add(entry_id, entry_tokens(rows[entry_id]))
+        else:
+            index.remove(entry_id)
+    return index
+
+
+def build_question_index():
+    """Trigram index of the questions, for misspelled queries"""
+    started = time.perf_counter()
+    index = TrigramIndex(KnowledgeBaseEntry.objects.values_list('id', 'question').iterator())
+    logger.info("KB question trigrams: %d entries, %d trigrams in %.0f ms",
+                len(index), len(index.postings), (time.perf_counter() - started) * 1000)
+    return index
+
+
+def update_question_index(index, entry_ids):
+    rows = dict(KnowledgeBaseEntry.objects.filter(id__in=entry_ids).values_list('id', 'question'))
+    for entry_id in entry_ids:
+        if entry_id in rows:
+            index.add(entry_id, rows[entry_id])
+        else:
+            index.remove(entry_id)
+    return index
+
+
+_index = LiveIndex(build_kb_index, update_kb_index)
+_question_index = LiveIndex(build_question_index, update_question_index)
+
+
+def get_kb_index():
+    """Return the process wide knowledge base index, up to date with the change log"""
+    return _index.get()
+
+
+def get_question_index():
+    return _question_index.get()
+
+
+def reset_kb_index():
+    """Drop the indexes so the next search rebuilds them from the table"""
+    _index.reset()
+    _question_index.reset()
@@ -0,0 +1,23 @@
+from .embeddings import embedding_bytes
+from .text import build_search_terms, hash_content, passage_rows
+
+# Runs in import_kb's worker processes, which import it without django.setup()
+# when they are spawned (macOS, Windows), so it must not import any models.
+
+
+def prepare_rows(rows):
+    """
+    Normalize a batch of (line, question, answer, source) rows: content hash,
+    search terms, embedding and passages of each row, or None for rows to skip.
+    """
+    prepared = []
+    for line, question, answer, source in rows:
+        if not question or not answer:
+            prepared.append((line, None))
+            continue
+        prepared.append((line, (
+            hash_content(question, answer), question, answer, source,
+            build_search_terms(question, answer), embedding_bytes(question, answer),
+            passage_rows(answer),
+        )))
+    return prepared
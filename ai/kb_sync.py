@@ -0,0 +1,77 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Seconds a knowledge base change stays in the shared change log. An index
+# further behind than that (or than KB_MAX_INCREMENTAL changes) is rebuilt.
+KB_CHANGE_LOG_TTL = getattr(settings, 'ASSISTANT_KB_CHANGE_LOG_TTL', 86400)
+KB_MAX_INCREMENTAL = getattr(settings, 'ASSISTANT_KB_MAX_INCREMENTAL', 1000)
+
+INDEX_VERSION_KEY = 'kb_index_version'
+CHANGE_KEY = 'kb_index_change_{}'
+# Logged instead of an entry id when every index has to be rebuilt
+RELOAD = 'reload'
+
+
+def kb_index_version():
+    return cache.get_or_set(INDEX_VERSION_KEY, 0, None)
+
+
+def record_kb_change(entry_id=None):
+    """
+    Log a changed (saved or deleted) entry, or with no id a bulk change that
+    needs a full rebuild, and return the new index version.
+    """
+    try:
+        version = cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        cache.add(INDEX_VERSION_KEY, 0, None)
+        version = cache.incr(INDEX_VERSION_KEY)
+    cache.set(CHANGE_KEY.format(version), RELOAD if entry_id is None else entry_id, KB_CHANGE_LOG_TTL)
+    return version
+
+
+def kb_changes_since(version, current):
+    """Ids of the entries changed after version, or None when only a rebuild will do"""
+    if not 0 <= version <= current or current - version > KB_MAX_INCREMENTAL:
+        return None
+    keys = [CHANGE_KEY.format(number) for number in range(version + 1, current + 1)]
+    logged = cache.get_many(keys)
+    if len(logged) != len(keys) or RELOAD in logged.values():
+        return None
+    return set(logged.values())
+
+
+class LiveIndex:
+    """
+    Process wide index kept in step with the shared change log.
+
+    get() costs one cache read while nothing changed. When other processes
+    (or this one) logged changes, the index is patched with update(index, ids),
+    which loads just those entries; it is rebuilt only on first use, after a
+    bulk change or when the log no longer covers the gap.
+    """
+
+    def __init__(self, build, update):
+        self.build = build
+        self.update = update
+        self.index = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        version = kb_index_version()
+        if self.index is not None and self.version == version:
+            return self.index
+        with self.lock:
+            version = kb_index_version()
+            if self.index is None or self.version != version:
+                changed = None if self.index is None else kb_changes_since(self.version, version)
+                # The version is read before loading, so changes made meanwhile are applied again next time
+                self.index = self.build() if changed is None else self.update(self.index, changed)
+                self.version = version
+        return self.index
+
+    def reset(self):
+        self.index = None
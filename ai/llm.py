@@ -0,0 +1,169 @@
+import asyncio
+import json
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+DEFAULT_LLM_SETTINGS = {
+    'BACKEND': 'ai.llm.GeminiBackend',
+    'MODEL': 'gemini-1.5-flash',
+    'API_KEY': '',
+    'TIMEOUT': 30,
+}
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+class LLMBackend:
+    """
+    Interface of the language model used by the assistant.
+
+    ``purpose`` tells the backend which pipeline stage is asking ("intent",
+    "keywords", "summary" or "answer"). Gemini uses it to request JSON output, the stub to
+    pick a canned reply.
+    """
+
+    def generate(self, prompt, purpose='answer'):
+        """Return the complete text for prompt"""
+        raise NotImplementedError
+
+    async def agenerate(self, prompt, purpose='answer'):
+        raise NotImplementedError
+
+    def stream(self, prompt, purpose='answer'):
+        """Yield the text for prompt in chunks"""
+        yield self.generate(prompt, purpose)
+
+    async def astream(self, prompt, purpose='answer'):
+        yield await self.agenerate(prompt, purpose)
+
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini through google-generativeai, one client per process"""
+
+    # Stages whose prompts ask for JSON get Gemini's JSON response mode
+    JSON_PURPOSES = ('intent', 'keywords')
+
+    def __init__(self, model='gemini-1.5-flash', api_key='', timeout=30, **options):
+        if not api_key:
+            raise ImproperlyConfigured(
+                "ASSISTANT_LLM['API_KEY'] is empty: set GEMINI_API_KEY or use 'ai.llm.StubBackend'"
+            )
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model)
+        self.request_options = {'timeout': timeout}
+
+    def _generation_config(self, purpose):
+        if purpose in self.JSON_PURPOSES:
+            return {'response_mime_type': 'application/json'}
+        return None
+
+    def generate(self, prompt, purpose='answer'):
+        response = self.model.generate_content(
+            prompt,
+            generation_config=self._generation_config(purpose),
+            request_options=self.request_options,
+        )
+        return response.text
+
+    async def agenerate(self, prompt, purpose='answer'):
+        response = await self.model.generate_content_async(
+            prompt,
+            generation_config=self._generation_config(purpose),
+            request_options=self.request_options,
+        )
+        return response.text
+
+    def stream(self, prompt, purpose='answer'):
+        for chunk in self.model.generate_content(prompt, stream=True, request_options=self.request_options):
+            yield chunk.text
+
+    async def astream(self, prompt, purpose='answer'):
+        response = await self.model.generate_content_async(prompt, stream=True, request_options=self.request_options)
+        async for chunk in response:
+            yield chunk.text
+
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic offline backend for load tests and benchmarks.
+
+    Returns canned replies after a fixed latency (seconds), so the whole
+    assistant pipeline can be exercised without calling Google.
+    """
+
+    DEFAULT_RESPONSES = {
+        'answer': "As far as I have information, I'm Troy University's AI assistant. "
+                  "Please visit troy.edu for more details.",
+    }
+
+    def __init__(self, latency=0.0, responses=None, **options):
+        self.latency = latency
+        self.responses = {**self.DEFAULT_RESPONSES, **(responses or {})}
+
+    def _reply(self, prompt, purpose):
+        if purpose in self.responses:
+            return self.responses[purpose]
+
+        # Echo the longer words of the query, like the Gemini prompts ask for
+        match = re.search(r'Query: "(.*)"', prompt)
+        words = match.group(1).lower().split() if match else []
+        keywords = [word for word in words if len(word) > 3][:5]
+        if purpose == 'keywords':
+            return json.dumps(keywords)
+        if purpose == 'intent':
+            return json.dumps({"intent": "other", "entities": {}, "requires_followup": False, "keywords": keywords})
+        if purpose == 'summary':
+            return "The user asked: " + "; ".join(re.findall(r'User: (.*)', prompt))
+        return self.responses['answer']
+
+    def generate(self, prompt, purpose='answer'):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._reply(prompt, purpose)
+
+    async def agenerate(self, prompt, purpose='answer'):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._reply(prompt, purpose)
+
+    def stream(self, prompt, purpose='answer'):
+        text = self.generate(prompt, purpose)
+        for word in re.findall(r'\S+\s*', text):
+            yield word
+
+    async def astream(self, prompt, purpose='answer'):
+        text = await self.agenerate(prompt, purpose)
+        for word in re.findall(r'\S+\s*', text):
+            yield word
+
+
+def build_llm(config=None):
+    """Instantiate the backend described by settings.ASSISTANT_LLM"""
+    config = {**DEFAULT_LLM_SETTINGS, **(config or getattr(settings, 'ASSISTANT_LLM', {}))}
+    backend_class = import_string(config['BACKEND'])
+    options = {key.lower(): value for key, value in config.items() if key != 'BACKEND'}
+    return backend_class(**options)
+
+
+def get_llm():
+    """Return the process wide backend, creating it on first use"""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = build_llm()
+    return _llm
+
+
+def reset_llm():
+    """Forget the current backend so the next get_llm() reads the settings again"""
+    global _llm
+    _llm = None
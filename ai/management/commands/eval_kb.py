@@ -0,0 +1,157 @@
+import csv
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ai.kb_index import reset_kb_index
+from ai.models import KnowledgeBaseEntry
+from ai.vectors import reset_vector_index
+from ai.views import KB_BACKENDS, fallback_keywords, kb_scores
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    rank = max(1, round(percent / 100 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+class Command(BaseCommand):
+    help = 'Measure recall@k, MRR, latency and index memory of the knowledge base search backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'labels', nargs='?',
+            help='JSONL ({"query": ..., "expected": [...]}) or CSV (query,expected) file. '
+                 'Expected entries are ids or exact questions; separate several with | in CSV.',
+        )
+        parser.add_argument('--backend', action='append', choices=KB_BACKENDS,
+                            help='Backend to evaluate (repeatable, default: all)')
+        parser.add_argument('-k', type=int, default=5, help='Results retrieved per query')
+        parser.add_argument('--sample', type=int, default=0,
+                            help='Without a labels file, use the questions of this many random entries')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['labels']:
+            cases = self.read_labels(options['labels'])
+        elif options['sample']:
+            cases = self.sample_labels(options['sample'], options['seed'])
+        else:
+            raise CommandError('Give a labels file or --sample N')
+        if not cases:
+            raise CommandError('No labeled queries to evaluate')
+
+        k = options['k']
+        report = {
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'k': k,
+            'queries': len(cases),
+            'entries': KnowledgeBaseEntry.objects.count(),
+            'backends': {},
+        }
+        for backend in options['backend'] or KB_BACKENDS:
+            report['backends'][backend] = result = self.evaluate(backend, cases, k)
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"{backend:7} recall@{k} {result['recall']:.3f}  MRR {result['mrr']:.3f}  "
+                f"p50 {latency['p50']:.2f} ms  p95 {latency['p95']:.2f} ms  p99 {latency['p99']:.2f} ms  "
+                f"index {result['index_memory_bytes'] / 1e6:.1f} MB built in {result['build_ms']:.0f} ms"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def evaluate(self, backend, cases, k):
+        # Indexes are built by the first query, with allocations traced
+        reset_kb_index()
+        reset_vector_index()
+        query, _ = cases[0]
+        tracemalloc.start()
+        started = time.perf_counter()
+        kb_scores(query, fallback_keywords(query), backend, k)
+        build_ms = (time.perf_counter() - started) * 1000
+        index_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        latencies = []
+        reciprocal_ranks = []
+        found = 0
+        misses = []
+        for query, expected in cases:
+            started = time.perf_counter()
+            ranked = [entry_id for entry_id, _ in kb_scores(query, fallback_keywords(query), backend, k)]
+            latencies.append((time.perf_counter() - started) * 1000)
+
+            rank = next((position for position, entry_id in enumerate(ranked, 1) if entry_id in expected), None)
+            if rank:
+                found += 1
+                reciprocal_ranks.append(1 / rank)
+            else:
+                reciprocal_ranks.append(0.0)
+                misses.append(query)
+
+        latencies.sort()
+        return {
+            'recall': found / len(cases),
+            'mrr': sum(reciprocal_ranks) / len(cases),
+            'latency_ms': {
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'mean': sum(latencies) / len(latencies),
+            },
+            'index_memory_bytes': index_memory,
+            'build_ms': build_ms,
+            'misses': misses[:20],
+        }
+
+    def read_labels(self, path):
+        """[(query, set of expected entry ids)] from a JSONL or CSV file"""
+        try:
+            with open(path, newline='', encoding='utf-8') as labels:
+                if path.endswith('.csv'):
+                    rows = [(row['query'], row['expected'].split('|')) for row in csv.DictReader(labels)]
+                else:
+                    rows = []
+                    for line in labels:
+                        if line.strip():
+                            item = json.loads(line)
+                            expected = item['expected']
+                            rows.append((item['query'], expected if isinstance(expected, list) else [expected]))
+        except FileNotFoundError:
+            raise CommandError(f'File not found: {path}')
+
+        questions = {}
+        for entry_id, question in KnowledgeBaseEntry.objects.values_list('id', 'question'):
+            questions.setdefault(question.strip().lower(), set()).add(entry_id)
+
+        cases = []
+        for query, expected in rows:
+            ids = set()
+            for item in expected:
+                item = str(item).strip()
+                if item.isdigit():
+                    ids.add(int(item))
+                else:
+                    ids |= questions.get(item.lower(), set())
+            if ids:
+                cases.append((query, ids))
+            else:
+                self.stdout.write(f'Skipping "{query}": no expected entry found')
+        return cases
+
+    def sample_labels(self, size, seed):
+        """Questions of random entries, each expected to find its own entry"""
+        ids = list(KnowledgeBaseEntry.objects.values_list('id', flat=True))
+        chosen = random.Random(seed).sample(ids, min(size, len(ids)))
+        rows = KnowledgeBaseEntry.objects.filter(id__in=chosen).values_list('id', 'question')
+        return [(question, {entry_id}) for entry_id, question in rows]
@@ -1,37 +1,226 @@
 import csv
-from django.core.management.base import BaseCommand
-from ai.models import KnowledgeBaseEntry
+import glob
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from ai.kb_cache import invalidate_kb_cache
+from ai.kb_rows import prepare_rows
+from ai.kb_sync import record_kb_change
+from ai.models import KnowledgeBaseEntry, KnowledgeBasePassage
+
+DEFAULT_PATH = 'ai/data/troy_kb_knowledge_base.csv'
+DEFAULT_CHECKPOINT = '.import_kb_checkpoint.json'
+EXTENSIONS = ('.csv', '.jsonl')
+
+
+def expand_paths(paths):
+    """CSV and JSONL files named by paths, directories (searched recursively) or glob patterns"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(
+                name for name in glob.glob(os.path.join(path, '**', '*'), recursive=True)
+                if name.endswith(EXTENSIONS)
+            )
+        elif glob.has_magic(path):
+            matches = sorted(name for name in glob.glob(path, recursive=True) if os.path.isfile(name))
+        else:
+            matches = [path]
+        files.extend(os.path.abspath(name) for name in matches if os.path.abspath(name) not in files)
+    return files
+
+
+def read_rows(file_path):
+    """(line number, question, answer, source) of every CSV or JSONL row, streamed"""
+    with open(file_path, newline='', encoding='utf-8') as data:
+        if file_path.endswith('.jsonl'):
+            rows = ((number, json.loads(line)) for number, line in enumerate(data, 1) if line.strip())
+        else:
+            reader = csv.DictReader(data)
+            rows = ((reader.line_num, row) for row in reader)
+        for line, row in rows:
+            yield (
+                line,
+                str(row.get('question') or '').strip(),
+                str(row.get('answer') or '').strip(),
+                str(row.get('source') or '').strip(),
+            )
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
 
 class Command(BaseCommand):
-    help = 'Import knowledge base entries from a CSV file'
+    help = ('Import knowledge base entries (question, answer, source) from CSV or JSONL files, '
+            'skipping ones already imported')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=[DEFAULT_PATH],
+                            help=f'Files, directories or glob patterns (default: {DEFAULT_PATH})')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows written per transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes normalizing rows (1 normalizes in this process)')
+        parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                            help='Progress file an interrupted import resumes from')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start over')
 
     def handle(self, *args, **kwargs):
-        file_path = 'ai/data/university_knowledge_base.csv'  # Adjust if needed
+        files = expand_paths(kwargs['paths'])
+        missing = [file_path for file_path in files if not os.path.isfile(file_path)]
+        if missing or not files:
+            raise CommandError(f"File not found: {', '.join(missing or kwargs['paths'])}")
+
+        self.counts = dict.fromkeys(('created', 'updated', 'unchanged', 'skipped'), 0)
+        self.checkpoint_path = kwargs['checkpoint']
+        self.progress = {} if kwargs['restart'] else self.load_checkpoint()
+        self.started = time.perf_counter()
+        self.read = 0
+        workers = max(1, kwargs['workers'])
 
+        # Forked workers must not share this process's database connections
+        connections.close_all()
+        pool = ProcessPoolExecutor(workers) if workers > 1 else None
         try:
-            with open(file_path, newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                count = 0
-                for i, row in enumerate(reader, 1):
-                    question = row.get('question', '').strip()
-                    answer = row.get('answer', '').strip()
-                    source = row.get('source', '').strip()
-
-                    if not question or not answer:
-                        self.stdout.write(f'Skipping row {i}: Missing question or answer')
-                        continue
-
-                    KnowledgeBaseEntry.objects.create(
-                        question=question,
-                        answer=answer,
-                        source=source
-                    )
-                    count += 1
-
-            self.stdout.write(self.style.SUCCESS(f'Successfully imported {count} entries.'))
-
-        except FileNotFoundError:
-            self.stdout.write(self.style.ERROR(f'File not found: {file_path}'))
+            for file_path in files:
+                self.import_file(file_path, kwargs['batch_size'], pool, workers)
+            # A finished import has nothing to resume
+            if os.path.exists(self.checkpoint_path):
+                os.remove(self.checkpoint_path)
 
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f'An error occurred: {str(e)}'))
+            # Every committed batch is in the checkpoint already
+            raise CommandError(
+                f'{e}\nProgress saved to {self.checkpoint_path}; run the command again to resume'
+            ) from e
+
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+            # Bulk writes send no model signals
+            if self.counts['created'] or self.counts['updated']:
+                record_kb_change()
+                invalidate_kb_cache()
+
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {created} new entries, updated {updated}, {unchanged} unchanged, '
+            '{skipped} skipped'.format(**self.counts) + f' from {len(files)} files in {elapsed:.1f} s'
+        ))
+
+    def import_file(self, file_path, batch_size, pool, workers):
+        """
+        Stream one file through the workers. Batches are written in file order
+        by this process alone, and the checkpoint moves past each once committed.
+        """
+        signature = file_signature(file_path)
+        done = self.progress.get(file_path)
+        done = done['rows'] if done and done['signature'] == signature else 0
+        if done:
+            self.stdout.write(f'{file_path}: resuming after {done} rows')
+
+        rows = batches(islice(read_rows(file_path), done, None), batch_size)
+        if pool is None:
+            prepared = map(prepare_rows, rows)
+        else:
+            prepared = self.in_order(pool, rows, workers * 2)
+
+        for batch in prepared:
+            self.write_batch(batch)
+            done += len(batch)
+            self.read += len(batch)
+            self.progress[file_path] = {'rows': done, 'signature': signature}
+            self.save_checkpoint()
+            elapsed = time.perf_counter() - self.started
+            self.stdout.write(f'{os.path.basename(file_path)}: {done} rows, {self.read / elapsed:.0f} rows/s overall')
+
+    @staticmethod
+    def in_order(pool, batches, window):
+        """Results of prepare_rows over batches, keeping at most window batches in flight"""
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(prepare_rows, batch))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as checkpoint:
+                return json.load(checkpoint)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save_checkpoint(self):
+        # Written aside and renamed, so an interruption never leaves half a file
+        partial = f'{self.checkpoint_path}.tmp'
+        with open(partial, 'w', encoding='utf-8') as checkpoint:
+            json.dump(self.progress, checkpoint)
+        os.replace(partial, self.checkpoint_path)
+
+    @transaction.atomic
+    def write_batch(self, rows):
+        """Insert new entries with their passages and update changed sources, in one transaction"""
+        incoming = {}
+        valid = 0
+        for line, row in rows:
+            if row is None:
+                self.stdout.write(f'Skipping row {line}: Missing question or answer')
+                self.counts['skipped'] += 1
+                continue
+            valid += 1
+            incoming[row[0]] = row
+        # Rows repeating an earlier row of the batch
+        self.counts['unchanged'] += valid - len(incoming)
+
+        existing = {
+            content_hash: (entry_id, source)
+            for content_hash, entry_id, source in KnowledgeBaseEntry.objects.filter(
+                content_hash__in=incoming
+            ).values_list('content_hash', 'id', 'source')
+        }
+
+        new_entries = []
+        passages = []
+        changed = []
+        for content_hash, question, answer, source, search_terms, embedding, passage_terms in incoming.values():
+            if content_hash not in existing:
+                new_entries.append(KnowledgeBaseEntry(
+                    question=question, answer=answer, source=source,
+                    content_hash=content_hash, search_terms=search_terms, embedding=embedding,
+                ))
+                passages.append(passage_terms)
+                continue
+            entry_id, stored_source = existing[content_hash]
+            if (stored_source or '') != source:
+                changed.append(KnowledgeBaseEntry(id=entry_id, source=source))
+            else:
+                self.counts['unchanged'] += 1
+
+        KnowledgeBaseEntry.objects.bulk_create(new_entries)
+        KnowledgeBasePassage.objects.bulk_create(
+            [
+                KnowledgeBasePassage(entry_id=entry.id, position=position, text=text, search_terms=terms)
+                for entry, entry_passages in zip(new_entries, passages)
+                for position, text, terms in entry_passages
+            ],
+            batch_size=1000,
+        )
+        KnowledgeBaseEntry.objects.bulk_update(changed, ['source'])
+        self.counts['created'] += len(new_entries)
+        self.counts['updated'] += len(changed)
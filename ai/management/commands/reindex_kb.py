@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ai.embeddings import embedding_bytes
+from ai.kb_cache import invalidate_kb_cache
+from ai.kb_sync import record_kb_change
+from ai.models import KnowledgeBaseEntry, KnowledgeBasePassage, build_passages
+from ai.text import build_search_terms, hash_content
+
+DERIVED_FIELDS = ['search_terms', 'content_hash', 'embedding']
+
+
+class Command(BaseCommand):
+    help = ('Recompute what is derived from knowledge base questions and answers (search terms, '
+            'content hashes, embeddings and passages), after the text analysis or embedding changed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Entries rewritten per transaction')
+
+    def handle(self, *args, **kwargs):
+        started = time.perf_counter()
+        entries = KnowledgeBaseEntry.objects.order_by('id').values_list('id', 'question', 'answer')
+        done = last_id = 0
+        # Each slice is read whole before it is rewritten: SQLite gives no isolation
+        # between an open cursor and updates of the same table on one connection
+        while batch := list(entries.filter(id__gt=last_id)[:kwargs['batch_size']]):
+            self.write_batch(batch)
+            last_id = batch[-1][0]
+            done += len(batch)
+            self.stdout.write(f'{done} entries')
+
+        # Bulk writes send no model signals
+        record_kb_change()
+        invalidate_kb_cache()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Reindexed {done} entries in {elapsed:.1f} s'))
+
+    @transaction.atomic
+    def write_batch(self, rows):
+        entries = []
+        passages = []
+        for entry_id, question, answer in rows:
+            entries.append(KnowledgeBaseEntry(
+                id=entry_id,
+                search_terms=build_search_terms(question, answer),
+                content_hash=hash_content(question, answer),
+                embedding=embedding_bytes(question, answer),
+            ))
+            passages.extend(build_passages(entry_id, answer))
+        KnowledgeBaseEntry.objects.bulk_update(entries, DERIVED_FIELDS)
+        KnowledgeBasePassage.objects.filter(entry_id__in=[entry.id for entry in entries]).delete()
+        KnowledgeBasePassage.objects.bulk_create(passages, batch_size=1000)
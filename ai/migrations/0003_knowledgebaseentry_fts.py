@@ -0,0 +1,65 @@
+from django.db import migrations
+
+# External content FTS5 table over ai_knowledgebaseentry, kept in sync by triggers.
+# Other databases keep using the in-memory index, so everything is SQLite only.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS ai_knowledgebaseentry_fts USING fts5(
+        question, answer, search_terms,
+        content='ai_knowledgebaseentry', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ai_knowledgebaseentry_fts_insert
+    AFTER INSERT ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, question, answer, search_terms)
+        VALUES (new.id, new.question, new.answer, new.search_terms);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ai_knowledgebaseentry_fts_delete
+    AFTER DELETE ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, question, answer, search_terms)
+        VALUES ('delete', old.id, old.question, old.answer, old.search_terms);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ai_knowledgebaseentry_fts_update
+    AFTER UPDATE ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, question, answer, search_terms)
+        VALUES ('delete', old.id, old.question, old.answer, old.search_terms);
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, question, answer, search_terms)
+        VALUES (new.id, new.question, new.answer, new.search_terms);
+    END
+    """,
+    # Index the rows that already exist
+    "INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS ai_knowledgebaseentry_fts_insert",
+    "DROP TRIGGER IF EXISTS ai_knowledgebaseentry_fts_delete",
+    "DROP TRIGGER IF EXISTS ai_knowledgebaseentry_fts_update",
+    "DROP TABLE IF EXISTS ai_knowledgebaseentry_fts",
+]
+
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0002_knowledgebaseentry_search_terms_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(CREATE_SQL), run_on_sqlite(DROP_SQL)),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+# Writing embeddings must not reindex the full-text row, so the FTS update
+# trigger of 0003 only fires for the indexed columns from now on.
+TRIGGER_SQL = """
+    CREATE TRIGGER ai_knowledgebaseentry_fts_update
+    AFTER {event} ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, question, answer, search_terms)
+        VALUES ('delete', old.id, old.question, old.answer, old.search_terms);
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, question, answer, search_terms)
+        VALUES (new.id, new.question, new.answer, new.search_terms);
+    END
+"""
+
+
+def replace_update_trigger(event):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        schema_editor.execute("DROP TRIGGER IF EXISTS ai_knowledgebaseentry_fts_update")
+        schema_editor.execute(TRIGGER_SQL.format(event=event))
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0003_knowledgebaseentry_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebaseentry',
+            name='embedding',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(
+            replace_update_trigger('UPDATE OF question, answer, search_terms'),
+            replace_update_trigger('UPDATE'),
+        ),
+    ]
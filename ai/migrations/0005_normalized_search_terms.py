@@ -0,0 +1,123 @@
+from django.db import migrations
+
+# Computed with the current ai.text; after its analysis changes, stored values
+# are refreshed with `manage.py reindex_kb`, not by re-running this migration.
+from ai.text import build_search_terms
+
+# The full-text table now indexes search_terms alone. The terms are already
+# lowercased and stemmed, so the plain unicode61 tokenizer replaces porter.
+DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS ai_knowledgebaseentry_fts_insert",
+    "DROP TRIGGER IF EXISTS ai_knowledgebaseentry_fts_delete",
+    "DROP TRIGGER IF EXISTS ai_knowledgebaseentry_fts_update",
+    "DROP TABLE IF EXISTS ai_knowledgebaseentry_fts",
+]
+
+CREATE_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE ai_knowledgebaseentry_fts USING fts5(
+        search_terms,
+        content='ai_knowledgebaseentry', content_rowid='id',
+        tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER ai_knowledgebaseentry_fts_insert
+    AFTER INSERT ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, search_terms) VALUES (new.id, new.search_terms);
+    END
+    """,
+    """
+    CREATE TRIGGER ai_knowledgebaseentry_fts_delete
+    AFTER DELETE ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, search_terms)
+        VALUES ('delete', old.id, old.search_terms);
+    END
+    """,
+    """
+    CREATE TRIGGER ai_knowledgebaseentry_fts_update
+    AFTER UPDATE OF search_terms ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, search_terms)
+        VALUES ('delete', old.id, old.search_terms);
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, search_terms) VALUES (new.id, new.search_terms);
+    END
+    """,
+    "INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts) VALUES ('rebuild')",
+]
+
+# Layout of migrations 0003 and 0004, restored when migrating backwards
+PREVIOUS_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE ai_knowledgebaseentry_fts USING fts5(
+        question, answer, search_terms,
+        content='ai_knowledgebaseentry', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER ai_knowledgebaseentry_fts_insert
+    AFTER INSERT ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, question, answer, search_terms)
+        VALUES (new.id, new.question, new.answer, new.search_terms);
+    END
+    """,
+    """
+    CREATE TRIGGER ai_knowledgebaseentry_fts_delete
+    AFTER DELETE ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, question, answer, search_terms)
+        VALUES ('delete', old.id, old.question, old.answer, old.search_terms);
+    END
+    """,
+    """
+    CREATE TRIGGER ai_knowledgebaseentry_fts_update
+    AFTER UPDATE OF question, answer, search_terms ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, question, answer, search_terms)
+        VALUES ('delete', old.id, old.question, old.answer, old.search_terms);
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, question, answer, search_terms)
+        VALUES (new.id, new.question, new.answer, new.search_terms);
+    END
+    """,
+    "INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts) VALUES ('rebuild')",
+]
+
+
+def run_on_sqlite(schema_editor, statements):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in statements:
+            schema_editor.execute(statement)
+
+
+def fill_search_terms(apps, schema_editor, batch_size=500):
+    KnowledgeBaseEntry = apps.get_model('ai', 'KnowledgeBaseEntry')
+    entries = KnowledgeBaseEntry.objects.order_by('id').values_list('id', 'question', 'answer')
+    last_id = 0
+    # Slices are read whole before writing: SQLite gives no isolation between
+    # an open cursor and updates of the same table on one connection
+    while rows := list(entries.filter(id__gt=last_id)[:batch_size]):
+        last_id = rows[-1][0]
+        KnowledgeBaseEntry.objects.bulk_update([
+            KnowledgeBaseEntry(id=entry_id, search_terms=build_search_terms(question, answer))
+            for entry_id, question, answer in rows
+        ], ['search_terms'])
+
+
+def forwards(apps, schema_editor):
+    run_on_sqlite(schema_editor, DROP_FTS_SQL)
+    fill_search_terms(apps, schema_editor)
+    run_on_sqlite(schema_editor, CREATE_FTS_SQL)
+
+
+def backwards(apps, schema_editor):
+    run_on_sqlite(schema_editor, DROP_FTS_SQL)
+    run_on_sqlite(schema_editor, PREVIOUS_FTS_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0004_knowledgebaseentry_embedding'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,46 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Computed with the current ai.text; after its analysis changes, stored values
+# are refreshed with `manage.py reindex_kb`, not by re-running this migration.
+from ai.text import build_search_terms, split_passages
+
+
+def create_passages(apps, schema_editor, batch_size=1000):
+    KnowledgeBaseEntry = apps.get_model('ai', 'KnowledgeBaseEntry')
+    KnowledgeBasePassage = apps.get_model('ai', 'KnowledgeBasePassage')
+    batch = []
+    for entry_id, question, answer in KnowledgeBaseEntry.objects.values_list('id', 'question', 'answer').iterator():
+        for position, text in enumerate(split_passages(answer)):
+            batch.append(KnowledgeBasePassage(
+                entry_id=entry_id, position=position, text=text,
+                search_terms=build_search_terms(question, text),
+            ))
+        if len(batch) >= batch_size:
+            KnowledgeBasePassage.objects.bulk_create(batch)
+            batch = []
+    KnowledgeBasePassage.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0005_normalized_search_terms'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeBasePassage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('text', models.TextField()),
+                ('search_terms', models.TextField(blank=True, default='')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='passages', to='ai.knowledgebaseentry')),
+            ],
+            options={
+                'ordering': ['entry', 'position'],
+            },
+        ),
+        migrations.RunPython(create_passages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+# Computed with the current ai.text; after its analysis changes, stored values
+# are refreshed with `manage.py reindex_kb`, not by re-running this migration.
+from ai.text import hash_content
+
+
+def fill_content_hash(apps, schema_editor, batch_size=1000):
+    KnowledgeBaseEntry = apps.get_model('ai', 'KnowledgeBaseEntry')
+    entries = KnowledgeBaseEntry.objects.order_by('id').values_list('id', 'question', 'answer')
+    last_id = 0
+    # Slices are read whole before writing: SQLite gives no isolation between
+    # an open cursor and updates of the same table on one connection
+    while rows := list(entries.filter(id__gt=last_id)[:batch_size]):
+        last_id = rows[-1][0]
+        KnowledgeBaseEntry.objects.bulk_update([
+            KnowledgeBaseEntry(id=entry_id, content_hash=hash_content(question, answer))
+            for entry_id, question, answer in rows
+        ], ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0006_knowledgebasepassage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebaseentry',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
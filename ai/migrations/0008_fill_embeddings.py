@@ -0,0 +1,32 @@
+from django.db import migrations
+
+from ai.embeddings import EMBEDDING_DIM, embedding_bytes
+
+
+def fill_embeddings(apps, schema_editor, batch_size=500):
+    # Entries saved before embeddings were written with them. Embeddings
+    # computed by a later version of ai.embeddings are refreshed with
+    # `manage.py reindex_kb`, not by this migration.
+    KnowledgeBaseEntry = apps.get_model('ai', 'KnowledgeBaseEntry')
+    entries = KnowledgeBaseEntry.objects.order_by('id').values_list('id', 'question', 'answer', 'embedding')
+    last_id = 0
+    # Slices are read whole before writing: SQLite gives no isolation between
+    # an open cursor and updates of the same table on one connection
+    while rows := list(entries.filter(id__gt=last_id)[:batch_size]):
+        last_id = rows[-1][0]
+        KnowledgeBaseEntry.objects.bulk_update([
+            KnowledgeBaseEntry(id=entry_id, embedding=embedding_bytes(question, answer))
+            for entry_id, question, answer, embedding in rows
+            if embedding is None or len(embedding) != EMBEDDING_DIM * 4
+        ], ['embedding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0007_knowledgebaseentry_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_embeddings, migrations.RunPython.noop),
+    ]
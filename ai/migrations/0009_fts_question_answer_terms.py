@@ -0,0 +1,112 @@
+from django.db import migrations
+
+# The full-text table gets separate question_terms and answer_terms columns,
+# so bm25() can weigh question matches higher again (as it did before 0005
+# and as the in-memory index does). They are the first and second line of
+# search_terms, split by the triggers, so the table is contentless.
+QUESTION_TERMS = "substr({row}.search_terms, 1, instr({row}.search_terms || char(10), char(10)) - 1)"
+ANSWER_TERMS = "substr({row}.search_terms, instr({row}.search_terms || char(10), char(10)) + 1)"
+
+
+def terms(row):
+    return f"{QUESTION_TERMS.format(row=row)}, {ANSWER_TERMS.format(row=row)}"
+
+
+DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS ai_knowledgebaseentry_fts_insert",
+    "DROP TRIGGER IF EXISTS ai_knowledgebaseentry_fts_delete",
+    "DROP TRIGGER IF EXISTS ai_knowledgebaseentry_fts_update",
+    "DROP TABLE IF EXISTS ai_knowledgebaseentry_fts",
+]
+
+CREATE_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE ai_knowledgebaseentry_fts USING fts5(
+        question_terms, answer_terms, content='', tokenize='unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER ai_knowledgebaseentry_fts_insert
+    AFTER INSERT ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, question_terms, answer_terms)
+        VALUES (new.id, {terms('new')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER ai_knowledgebaseentry_fts_delete
+    AFTER DELETE ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, question_terms, answer_terms)
+        VALUES ('delete', old.id, {terms('old')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER ai_knowledgebaseentry_fts_update
+    AFTER UPDATE OF search_terms ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, question_terms, answer_terms)
+        VALUES ('delete', old.id, {terms('old')});
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, question_terms, answer_terms)
+        VALUES (new.id, {terms('new')});
+    END
+    """,
+    # Contentless tables cannot 'rebuild', so the existing rows are inserted
+    f"""
+    INSERT INTO ai_knowledgebaseentry_fts(rowid, question_terms, answer_terms)
+    SELECT id, {terms('ai_knowledgebaseentry')} FROM ai_knowledgebaseentry
+    """,
+]
+
+# Layout of migration 0005, restored when migrating backwards
+PREVIOUS_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE ai_knowledgebaseentry_fts USING fts5(
+        search_terms,
+        content='ai_knowledgebaseentry', content_rowid='id',
+        tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER ai_knowledgebaseentry_fts_insert
+    AFTER INSERT ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, search_terms) VALUES (new.id, new.search_terms);
+    END
+    """,
+    """
+    CREATE TRIGGER ai_knowledgebaseentry_fts_delete
+    AFTER DELETE ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, search_terms)
+        VALUES ('delete', old.id, old.search_terms);
+    END
+    """,
+    """
+    CREATE TRIGGER ai_knowledgebaseentry_fts_update
+    AFTER UPDATE OF search_terms ON ai_knowledgebaseentry BEGIN
+        INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts, rowid, search_terms)
+        VALUES ('delete', old.id, old.search_terms);
+        INSERT INTO ai_knowledgebaseentry_fts(rowid, search_terms) VALUES (new.id, new.search_terms);
+    END
+    """,
+    "INSERT INTO ai_knowledgebaseentry_fts(ai_knowledgebaseentry_fts) VALUES ('rebuild')",
+]
+
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0008_fill_embeddings'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_on_sqlite(DROP_FTS_SQL + CREATE_FTS_SQL),
+            run_on_sqlite(DROP_FTS_SQL + PREVIOUS_FTS_SQL),
+        ),
+    ]
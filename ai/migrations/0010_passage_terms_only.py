@@ -0,0 +1,45 @@
+from django.db import migrations
+
+from ai.text import analyze
+
+
+def rewrite_passage_terms(apps, convert, batch_size=1000):
+    """Replace each passage's search_terms by convert(question, search_terms), unless it returns None"""
+    KnowledgeBasePassage = apps.get_model('ai', 'KnowledgeBasePassage')
+    passages = KnowledgeBasePassage.objects.order_by('id').values_list('id', 'entry__question', 'search_terms')
+    last_id = 0
+    # Slices are read whole before writing: SQLite gives no isolation between
+    # an open cursor and updates of the same table on one connection
+    while rows := list(passages.filter(id__gt=last_id)[:batch_size]):
+        last_id = rows[-1][0]
+        batch = [
+            KnowledgeBasePassage(id=passage_id, search_terms=terms)
+            for passage_id, question, search_terms in rows
+            if (terms := convert(question, search_terms)) is not None
+        ]
+        KnowledgeBasePassage.objects.bulk_update(batch, ['search_terms'])
+
+
+def passage_terms_only(apps, schema_editor):
+    # Passages stored "question terms\npassage terms" like their entry, but
+    # only the passage terms were ever read
+    rewrite_passage_terms(
+        apps, lambda question, terms: terms.partition('\n')[2] if '\n' in terms else None
+    )
+
+
+def question_and_passage_terms(apps, schema_editor):
+    rewrite_passage_terms(
+        apps, lambda question, terms: None if '\n' in terms else f"{' '.join(analyze(question))}\n{terms}"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai', '0009_fts_question_answer_terms'),
+    ]
+
+    operations = [
+        migrations.RunPython(passage_terms_only, question_and_passage_terms),
+    ]
@@ -1,23 +1,64 @@
 # models.py
 from django.db import models
 from django.utils import timezone
-from django.contrib.postgres.fields import ArrayField
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 
+from .embeddings import embedding_bytes
+from .text import build_search_terms, hash_content, passage_rows
+
 class KnowledgeBaseEntry(models.Model):
     question = models.TextField()
     answer = models.TextField()
     source = models.URLField(max_length=1000, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
-    # Optional: Add this if you want better search capabilities
+    # Normalized terms from ai.text.build_search_terms(); the only field search indexes
     search_terms = models.TextField(blank=True, null=True)
+
+    # float32 vector from ai.embeddings.embed_entry(), written with the question and answer
+    embedding = models.BinaryField(blank=True, null=True, editable=False)
+
+    # ai.text.hash_content() of the question and answer; import_kb skips rows it already has
+    content_hash = models.CharField(max_length=64, blank=True, null=True, editable=False, db_index=True)
     
     def __str__(self):
         return self.question[:100]
     
     def save(self, *args, **kwargs):
-        # Auto-generate search terms if not provided
-        if not hasattr(self, 'search_terms') or not self.search_terms:
-            super().save(*args, **kwargs)
\ No newline at end of file
+        # Search terms and passages follow the question and answer on every save
+        update_fields = kwargs.get('update_fields')
+        changed = update_fields is None or bool({'question', 'answer'} & set(update_fields))
+        if changed:
+            self.search_terms = build_search_terms(self.question, self.answer)
+            self.content_hash = hash_content(self.question, self.answer)
+            self.embedding = embedding_bytes(self.question, self.answer)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'search_terms', 'content_hash', 'embedding'}
+        super().save(*args, **kwargs)
+        if changed:
+            self.passages.all().delete()
+            KnowledgeBasePassage.objects.bulk_create(build_passages(self.id, self.answer))
+
+
+class KnowledgeBasePassage(models.Model):
+    """Overlapping slice of an entry's answer, so prompts carry only the part that matched"""
+    entry = models.ForeignKey(KnowledgeBaseEntry, on_delete=models.CASCADE, related_name='passages')
+    position = models.PositiveIntegerField()
+    text = models.TextField()
+    # Normalized terms (ai.text.analyze()) of this passage's text
+    search_terms = models.TextField(blank=True, default='')
+
+    class Meta:
+        ordering = ['entry', 'position']
+
+    def __str__(self):
+        return f"{self.entry_id}:{self.position} {self.text[:80]}"
+
+
+def build_passages(entry_id, answer):
+    """Unsaved passages of an answer (bulk_create them)"""
+    return [
+        KnowledgeBasePassage(entry_id=entry_id, position=position, text=text, search_terms=search_terms)
+        for position, text, search_terms in passage_rows(answer)
+    ]
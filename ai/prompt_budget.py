@@ -0,0 +1,91 @@
+import json
+
+from django.conf import settings
+
+# Rows of each intent sent to the model; anything else falls back to 'default'
+PROMPT_MAX_ROWS = {
+    'default': 10,
+    'student_info': 10,
+    'enrollment_info': 10,
+    'announcement': 5,
+    'knowledge_base': 5,
+    **getattr(settings, 'ASSISTANT_PROMPT_MAX_ROWS', {}),
+}
+
+# Fields of each row the model needs to answer; rows of unknown intents keep all fields
+PROMPT_FIELDS = {
+    'department_info': ['name', 'code', 'location', 'contact', 'website', 'head', 'description'],
+    'faculty_info': ['name', 'title', 'department', 'office', 'email', 'office_hours', 'research'],
+    'student_info': ['name', 'student_id', 'program', 'status', 'gpa', 'advisor', 'expected_graduation'],
+    'program_info': ['name', 'code', 'type', 'degree', 'department', 'credits', 'duration', 'description'],
+    'course_info': ['code', 'title', 'department', 'level', 'credits', 'is_core', 'prerequisites', 'description'],
+    'enrollment_info': ['student', 'student_id', 'course_code', 'course', 'semester', 'grade', 'status'],
+    'building_info': ['name', 'code', 'location', 'description'],
+    'room_info': ['building', 'building_code', 'room_number', 'type', 'capacity', 'features'],
+    'announcement': ['title', 'content', 'date', 'is_urgent', 'target'],
+    'knowledge_base': ['question', 'answer', 'source'],
+    **getattr(settings, 'ASSISTANT_PROMPT_FIELDS', {}),
+}
+
+# Long text values (descriptions, answers...) are cut to this many characters
+PROMPT_TEXT_CHARS = getattr(settings, 'ASSISTANT_PROMPT_TEXT_CHARS', 400)
+
+# Hard ceiling on the estimated tokens of the data block
+PROMPT_MAX_TOKENS = getattr(settings, 'ASSISTANT_PROMPT_MAX_TOKENS', 3000)
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+
+def truncate_text(value, limit=PROMPT_TEXT_CHARS):
+    if not isinstance(value, str) or len(value) <= limit:
+        return value
+    cut = value[:limit].rsplit(' ', 1)[0]
+    return cut + "..."
+
+
+def _compact(data):
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def _row_kind(intent, row):
+    if isinstance(row, dict) and row.get('type') == 'knowledge_base':
+        return 'knowledge_base'
+    return intent
+
+
+def budget_row(row, fields):
+    if not isinstance(row, dict):
+        return row
+    keys = fields if fields is not None else row.keys()
+    return {key: truncate_text(row[key]) for key in keys if key in row and row[key] not in (None, '', [])}
+
+
+def budget_result_data(intent, result_data, total_rows=None):
+    """
+    Shrink result_data to what the answer prompt needs.
+
+    Returns (payload, stats) where payload is compact JSON and stats holds the
+    number of rows kept, the number of rows available (total_rows when the
+    caller fetched only a slice) and the estimated tokens.
+    """
+    if not isinstance(result_data, list):
+        payload = _compact(result_data)
+        return payload, {'rows': 1, 'total_rows': 1, 'tokens': estimate_tokens(payload)}
+
+    kind = _row_kind(intent, result_data[0]) if result_data else intent
+    max_rows = PROMPT_MAX_ROWS.get(kind, PROMPT_MAX_ROWS['default'])
+    fields = PROMPT_FIELDS.get(kind)
+    rows = [budget_row(row, fields) for row in result_data[:max_rows]]
+
+    payload = _compact(rows)
+    # Drop rows from the end until the data block fits the token ceiling
+    while len(rows) > 1 and estimate_tokens(payload) > PROMPT_MAX_TOKENS:
+        rows.pop()
+        payload = _compact(rows)
+
+    total_rows = max(total_rows or 0, len(result_data))
+    stats = {'rows': len(rows), 'total_rows': total_rows, 'tokens': estimate_tokens(payload)}
+    return payload, stats
@@ -0,0 +1,140 @@
+import select
+import socket
+import threading
+from urllib.parse import unquote, urlparse
+
+
+class RespError(Exception):
+    """Error reply from the server"""
+
+
+class RespClient:
+    """
+    Minimal client for servers speaking the Redis protocol (RESP2).
+
+    Only what the context store needs: single commands, pipelines and
+    transactions over one connection per thread. Commands are resent on a
+    new connection only when sending them failed; once sent, the server may
+    have run them, so a failure while reading the replies is raised.
+    URLs look like redis://[:password@]host[:port][/db].
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', timeout=5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.reader = sock.makefile('rb')
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            # A connection is only kept once it is authenticated and on its database
+            try:
+                sock.sendall(b''.join(self.encode(command) for command in setup))
+                self._replies(len(setup))
+            except BaseException:
+                self.close()
+                raise
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        # An idle connection with something to read was closed or reset by the server
+        if sock is not None and select.select([sock], [], [], 0)[0]:
+            self.close()
+            sock = None
+        if sock is None:
+            self._connect()
+        return self._local.sock
+
+    def close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            self._local.reader.close()
+            sock.close()
+            self._local.sock = None
+
+    @staticmethod
+    def encode(command):
+        parts = [b'*%d\r\n' % len(command)]
+        for arg in command:
+            if isinstance(arg, str):
+                arg = arg.encode('utf-8')
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    def _read(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode('utf-8')
+        if kind == b'-':
+            return RespError(body.decode('utf-8'))
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            return self._local.reader.read(length + 2)[:-2]
+        if kind == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [self._read() for _ in range(length)]
+        raise ConnectionError(f'Unexpected reply {line!r}')
+
+    def _replies(self, count):
+        replies = [self._read() for _ in range(count)]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def pipeline(self, *commands, retry=True):
+        """Send commands in one round trip and return their replies"""
+        payload = b''.join(self.encode(command) for command in commands)
+        for attempt in (1, 2):
+            sock = self._connection()
+            try:
+                sock.sendall(payload)
+                break
+            except OSError:
+                self.close()
+                if attempt == 2 or not retry:
+                    raise
+        try:
+            return self._replies(len(commands))
+        except OSError:
+            # Whether the server ran the commands is unknown, the connection is not reused
+            self.close()
+            raise
+
+    def transaction(self, *commands):
+        """Run commands atomically (MULTI/EXEC) and return their replies"""
+        # Never resent: a transaction runs at most once
+        replies = self.pipeline(('MULTI',), *commands, ('EXEC',), retry=False)
+        results = replies[-1]
+        if results is None:
+            raise RespError('Transaction aborted')
+        for result in results:
+            if isinstance(result, RespError):
+                raise result
+        return results
+
+    def execute(self, *command):
+        return self.pipeline(command)[0]
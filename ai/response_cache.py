@@ -0,0 +1,87 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+RESPONSE_CACHE_SIZE = getattr(settings, 'ASSISTANT_RESPONSE_CACHE_SIZE', 1024)
+RESPONSE_CACHE_TTL = getattr(settings, 'ASSISTANT_RESPONSE_CACHE_TTL', 900)
+
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    query = re.sub(r'\s+', ' ', query.lower()).strip()
+    return query.rstrip('?!. ')
+
+
+def data_fingerprint(result_data):
+    """Stable hash of the data an answer was generated from"""
+    payload = json.dumps(result_data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    In-process LRU cache of generated answers with a TTL.
+
+    Keys include a fingerprint of the result data, so an answer goes stale as
+    soon as the rows it was generated from change.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query, intent, result_data):
+        raw = f"{normalize_query(query)}|{intent}|{data_fingerprint(result_data)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached text for key or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, text):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache()
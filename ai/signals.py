@@ -0,0 +1,23 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .kb_cache import invalidate_kb_cache
+from .kb_sync import record_kb_change
+from .models import KnowledgeBaseEntry
+
+
+# bulk_create/bulk_update/QuerySet.delete send no signals; callers of those
+# call invalidate_kb_cache() and record_kb_change() themselves
+@receiver(post_save, sender=KnowledgeBaseEntry)
+@receiver(post_delete, sender=KnowledgeBaseEntry)
+def knowledge_base_changed(sender, instance, **kwargs):
+    # Other processes read the entry back, so only announce committed changes
+    # (the id is taken now because a deleted instance loses it)
+    entry_id = instance.id
+
+    def announce():
+        record_kb_change(entry_id)
+        invalidate_kb_cache()
+
+    transaction.on_commit(announce)
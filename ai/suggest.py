@@ -0,0 +1,190 @@
+import heapq
+import logging
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+
+from university.models import Building, Course, Department
+from .models import KnowledgeBaseEntry
+from .text import STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the suggestion index is rebuilt (in the background, while the
+# old one keeps answering) and suggestions returned by default
+SUGGEST_TTL = getattr(settings, 'ASSISTANT_SUGGEST_TTL', 300)
+SUGGEST_LIMIT = getattr(settings, 'ASSISTANT_SUGGEST_LIMIT', 8)
+MAX_SUGGEST_LIMIT = 20
+
+# Base weight of each kind of suggestion, multiplied by its popularity
+KIND_WEIGHTS = {'question': 1.0, 'course': 1.2, 'department': 1.5, 'building': 1.3}
+# Matching the start of a suggestion counts this much more than matching a later word
+START_BONUS = 2.0
+# Keys for later words are cut to this length; longer prefixes are checked against the text
+KEY_CHARS = 32
+# Prefixes matching more keys than this have their ranking computed once and kept
+SCAN_LIMIT = 2000
+
+NORMALIZE_RE = re.compile(r'[^a-z0-9]+')
+
+_index = None
+_built_at = 0.0
+_index_lock = threading.Lock()
+_rebuilding = threading.Event()
+
+# KnowledgeBaseEntry ids returned by searches in this process, as their popularity
+kb_hit_counts = Counter()
+
+
+def normalize(text):
+    return NORMALIZE_RE.sub(' ', (text or '').lower()).strip()
+
+
+def record_kb_hits(hits):
+    kb_hit_counts.update(hit.id for hit in hits)
+
+
+class SuggestionIndex:
+    """
+    Prefix search over a sorted array of normalized keys.
+
+    Every suggestion is keyed by its whole text and by the text from each
+    later non-stopword word on, so "hours" suggests "What are the library
+    hours?". A lookup is two bisections plus a ranking of the matched range.
+    """
+
+    def __init__(self, suggestions):
+        # suggestions: (text, kind, value, weight, extra keys)
+        self.items = []
+        pairs = []
+        for text, kind, value, weight, extra_keys in suggestions:
+            normalized = normalize(text)
+            if not normalized:
+                continue
+            item = len(self.items)
+            self.items.append((text, kind, value, normalized))
+            pairs.append((normalized, item, weight * START_BONUS))
+            for key in extra_keys:
+                pairs.append((normalize(key), item, weight * START_BONUS))
+            words = normalized.split(' ')
+            for start in range(1, len(words)):
+                if words[start] not in STOPWORDS:
+                    pairs.append((' '.join(words[start:])[:KEY_CHARS], item, weight))
+        pairs.sort()
+        self.keys = [key for key, _, _ in pairs]
+        self.key_items = [item for _, item, _ in pairs]
+        self.scores = [score for _, _, score in pairs]
+        self._ranked = {}
+
+    def _ranking(self, lo, hi):
+        """Key positions from lo to hi, best first"""
+        if hi - lo <= SCAN_LIMIT:
+            return sorted(range(lo, hi), key=self.scores.__getitem__, reverse=True)
+        ranked = self._ranked.get((lo, hi))
+        if ranked is None:
+            # Enough to fill the largest limit even when items repeat
+            ranked = heapq.nlargest(MAX_SUGGEST_LIMIT * 4, range(lo, hi), key=self.scores.__getitem__)
+            self._ranked[(lo, hi)] = ranked
+        return ranked
+
+    def search(self, prefix, limit=SUGGEST_LIMIT):
+        """Up to limit suggestion dicts whose text or a later word starts with prefix"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        lookup = prefix[:KEY_CHARS]
+        lo = bisect_left(self.keys, lookup)
+        # Normalized keys hold only [a-z0-9 ], which all sort before '~'
+        hi = bisect_left(self.keys, lookup + '~', lo)
+
+        suggestions = []
+        seen = set()
+        for position in self._ranking(lo, hi):
+            item = self.key_items[position]
+            if item in seen:
+                continue
+            text, kind, value, normalized = self.items[item]
+            if len(prefix) > KEY_CHARS and prefix not in normalized:
+                continue
+            seen.add(item)
+            suggestions.append({'text': text, 'type': kind, 'value': value})
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+    def __len__(self):
+        return len(self.items)
+
+
+def popularity(count):
+    return 1.0 + math.log1p(count)
+
+
+def suggestion_rows():
+    """(text, kind, value, weight, extra keys) for every suggestion, four queries in all"""
+    for entry_id, question in KnowledgeBaseEntry.objects.values_list('id', 'question').iterator():
+        yield question, 'question', entry_id, KIND_WEIGHTS['question'] * popularity(kb_hit_counts[entry_id]), ()
+
+    courses = Course.objects.annotate(enrollments=Count('courseoffering__enrollment')).values_list(
+        'code', 'title', 'enrollments'
+    )
+    for code, title, enrollments in courses:
+        # Found by code ("CS 2255", "cs2255") as well as by title
+        keys = (code, code.replace(' ', '')) if code else ()
+        yield f"{code} {title}".strip(), 'course', code, KIND_WEIGHTS['course'] * popularity(enrollments), keys + (title,)
+
+    departments = Department.objects.annotate(courses=Count('course')).values_list('name', 'code', 'courses')
+    for name, code, courses in departments:
+        yield name, 'department', code, KIND_WEIGHTS['department'] * popularity(courses), (code,)
+
+    buildings = Building.objects.annotate(rooms=Count('room')).values_list('name', 'code', 'rooms')
+    for name, code, rooms in buildings:
+        yield name, 'building', code, KIND_WEIGHTS['building'] * popularity(rooms), (code,)
+
+
+def build_suggestion_index():
+    started = time.perf_counter()
+    index = SuggestionIndex(suggestion_rows())
+    logger.info("Suggestion index: %d suggestions, %d keys in %.0f ms",
+                len(index), len(index.keys), (time.perf_counter() - started) * 1000)
+    return index
+
+
+def _rebuild():
+    global _index, _built_at
+    try:
+        _index = build_suggestion_index()
+        _built_at = time.monotonic()
+    finally:
+        connection.close()
+        _rebuilding.clear()
+
+
+def get_suggestion_index():
+    """
+    Return the suggestion index, building it on first use. Once SUGGEST_TTL
+    has passed it is rebuilt in a background thread, so lookups never wait
+    for the database after the first one.
+    """
+    global _index, _built_at
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_suggestion_index()
+                _built_at = time.monotonic()
+    elif time.monotonic() - _built_at > SUGGEST_TTL and not _rebuilding.is_set():
+        _rebuilding.set()
+        threading.Thread(target=_rebuild, daemon=True).start()
+    return _index
+
+
+def reset_suggestion_index():
+    global _index
+    _index = None
@@ -0,0 +1,79 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .context_store import CONTEXT_TURNS, get_context_store, save_summary
+from .llm import get_llm
+
+logger = logging.getLogger(__name__)
+
+# The summary is brought up to date every SUMMARY_EVERY exchanges, and prompts
+# carry it plus the last VERBATIM_TURNS exchanges word for word. SUMMARY_EVERY
+# stays below ASSISTANT_CONTEXT_TURNS: the history keeps one exchange more than
+# a summary job takes, so when a job is still running or fails, the next
+# exchange schedules one that still sees every unsummarized exchange.
+SUMMARY_EVERY = max(1, min(getattr(settings, 'ASSISTANT_SUMMARY_EVERY', 2), CONTEXT_TURNS - 1))
+SUMMARY_CHARS = getattr(settings, 'ASSISTANT_SUMMARY_CHARS', 600)
+VERBATIM_TURNS = getattr(settings, 'ASSISTANT_CONTEXT_VERBATIM_TURNS', 2)
+# Seconds another process waits before summarizing a conversation already being summarized
+SUMMARY_LOCK_TTL = 60
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='summary')
+
+
+def unsummarized(context):
+    return [turn for turn in context['conversation_history'] if turn['number'] > context['summarized']]
+
+
+def summary_prompt(summary, turns):
+    transcript = "\n".join(f"User: {turn['query']}\nAssistant: {turn['response']}" for turn in turns)
+    return f"""
+        Update the summary of a conversation between a Troy University student and the
+        university's assistant. Keep what the user wants, the people, courses, programs and
+        places they mentioned and anything already answered, in at most {SUMMARY_CHARS} characters.
+
+        Summary so far: {summary or "(none)"}
+
+        New exchanges:
+        {transcript}
+
+        Respond with just the new summary.
+        """
+
+
+def summarize(ip_address, created_at, summary, turns):
+    """Fold new exchanges into a conversation's stored summary (runs off the request path)"""
+    try:
+        text = get_llm().generate(summary_prompt(summary, turns), purpose='summary')
+        save_summary(ip_address, created_at, text.strip()[:SUMMARY_CHARS], turns[-1]['number'])
+    except Exception:
+        logger.exception("Conversation summary failed")
+    finally:
+        get_context_store().unlock(f'summary_{ip_address}')
+
+
+def schedule_summary(ip_address, context):
+    """Summarize in the background once SUMMARY_EVERY exchanges are unsummarized"""
+    if len(unsummarized(context)) < SUMMARY_EVERY:
+        return
+    # One summarizer per conversation, across processes sharing the context store
+    if get_context_store().try_lock(f'summary_{ip_address}', SUMMARY_LOCK_TTL):
+        _executor.submit(summarize, ip_address, context['created_at'], context['summary'], unsummarized(context))
+
+
+async def aschedule_summary(ip_address, context):
+    if len(unsummarized(context)) < SUMMARY_EVERY:
+        return
+    if await get_context_store().atry_lock(f'summary_{ip_address}', SUMMARY_LOCK_TTL):
+        _executor.submit(summarize, ip_address, context['created_at'], context['summary'], unsummarized(context))
+
+
+def conversation_prompt(context):
+    """The summary and the last exchanges of a conversation, for prompts ('' for a new one)"""
+    lines = []
+    if context['summary']:
+        lines.append(f"Summary of the earlier conversation: {context['summary']}")
+    for turn in list(context['conversation_history'])[-VERBATIM_TURNS:]:
+        lines.append(f"User: {turn['query']}\nAssistant: {turn['response']}")
+    return "\n".join(lines)
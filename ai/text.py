@@ -0,0 +1,179 @@
+import hashlib
+import re
+from functools import lru_cache
+
+from django.conf import settings
+
+# Words that carry no meaning for knowledge base searches
+STOPWORDS = frozenset("""
+a about after all also am an and any are as at be been but by can could did do does
+for from get got has have how i if in into is it its me my no not of on or our please
+should so tell than that the their them then there these they this to up us was we
+what when where which who whom why will with would you your
+""".split())
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Long answers are split into passages of about this many characters, each
+# repeating up to PASSAGE_OVERLAP characters of the previous one
+PASSAGE_CHARS = getattr(settings, 'ASSISTANT_KB_PASSAGE_CHARS', 400)
+PASSAGE_OVERLAP = getattr(settings, 'ASSISTANT_KB_PASSAGE_OVERLAP', 100)
+
+# Acronyms and common alternatives, expanded in both directions when search
+# terms are built: "CS" adds "computer science" and "computer science" adds "cs"
+SYNONYMS = {
+    'cs': 'computer science',
+    'gpa': 'grade point average',
+    'fafsa': 'free application for federal student aid financial aid',
+    'ta': 'teaching assistant',
+    'ra': 'resident assistant',
+    'esl': 'english as a second language',
+    'rotc': 'reserve officers training corps',
+    'sga': 'student government association',
+    'mba': 'master of business administration',
+    'phd': 'doctor of philosophy doctorate',
+    'bs': 'bachelor of science',
+    'ba': 'bachelor of arts',
+    'ms': 'master of science',
+    'ug': 'undergraduate',
+    'dept': 'department',
+    'prof': 'professor',
+    'dorm': 'residence hall housing',
+    'car': 'vehicle parking',
+    'cost': 'tuition fees price',
+    **getattr(settings, 'ASSISTANT_KB_SYNONYMS', {}),
+}
+
+# (suffix, replacement), first match wins
+STEM_RULES = (
+    ('ational', 'ate'), ('ization', 'ize'), ('iveness', 'ive'), ('fulness', 'ful'),
+    ('ations', 'ate'), ('ation', 'ate'), ('ments', ''), ('ment', ''), ('ness', ''),
+    ('ities', 'ity'), ('ies', 'y'), ('ingly', ''), ('ing', ''), ('edly', ''), ('ed', ''),
+    ('sses', 'ss'), ('xes', 'x'), ('ches', 'ch'), ('shes', 'sh'), ('s', ''),
+)
+# Words ending like this are not plurals
+NOT_PLURAL = ('ss', 'us', 'is')
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    """Light suffix-stripping stemmer ("courses", "course" -> "cours")"""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix, replacement in STEM_RULES:
+        if not word.endswith(suffix):
+            continue
+        if suffix == 's' and word.endswith(NOT_PLURAL):
+            break
+        base = word[:-len(suffix)] + replacement
+        if len(base) >= 3:
+            word = base
+            # "enrolled" -> "enroll", "planning" -> "plan"
+            if replacement == '' and len(word) > 3 and word[-1] == word[-2] and word[-1] not in 'aeioulsz':
+                word = word[:-1]
+        break
+    if len(word) > 4 and word.endswith('e'):
+        word = word[:-1]
+    return word
+
+
+def words(text):
+    """Lowercased words of text without stopwords"""
+    if not text:
+        return []
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def tokenize(text):
+    """Lowercased, stemmed tokens of text without stopwords"""
+    return [stem(word) for word in words(text)]
+
+
+def _expansions():
+    by_term = {}
+    by_phrase = {}
+    for term, expansion in SYNONYMS.items():
+        term = stem(term)
+        tokens = tuple(tokenize(expansion))
+        by_term[term] = tokens
+        if len(tokens) > 1:
+            by_phrase[tokens[:2]] = term
+    return by_term, by_phrase
+
+
+EXPAND_TERMS, EXPAND_PHRASES = _expansions()
+
+
+def analyze(text):
+    """tokenize() plus synonym and acronym expansions, used for entries and queries alike"""
+    tokens = tokenize(text)
+    extra = []
+    for token in tokens:
+        extra.extend(EXPAND_TERMS.get(token, ()))
+    # Phrases are recognised by their first two tokens
+    for pair in zip(tokens, tokens[1:]):
+        if pair in EXPAND_PHRASES:
+            extra.append(EXPAND_PHRASES[pair])
+    return tokens + extra
+
+
+def build_search_terms(question, answer):
+    """
+    Normalized terms stored in KnowledgeBaseEntry.search_terms.
+
+    The first line holds the question terms and the second the answer terms,
+    so indexes can weigh a match in the question higher.
+    """
+    return f"{' '.join(analyze(question))}\n{' '.join(analyze(answer))}"
+
+
+def hash_content(question, answer):
+    """SHA-256 of an entry's question and answer, ignoring case and whitespace"""
+    normalized = '\n'.join(' '.join(text.lower().split()) for text in (question, answer))
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def _pieces(text, size):
+    """Sentences of text, with sentences longer than size cut at word boundaries"""
+    for sentence in SENTENCE_RE.split(text.strip()):
+        while len(sentence) > size:
+            cut = sentence.rfind(' ', 0, size)
+            cut = cut if cut > 0 else size
+            yield sentence[:cut]
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            yield sentence
+
+
+def split_passages(text, size=PASSAGE_CHARS, overlap=PASSAGE_OVERLAP):
+    """Split text into overlapping passages of whole sentences, about size characters each"""
+    if not text or len(text) <= size:
+        return [text or '']
+    passages = []
+    current = []
+    length = 0
+    for piece in _pieces(text, size):
+        if current and length + len(piece) + 1 > size:
+            passages.append(' '.join(current))
+            # Carry the last sentences over, up to overlap characters
+            carried = []
+            for sentence in reversed(current):
+                if sum(map(len, carried)) + len(sentence) > overlap:
+                    break
+                carried.insert(0, sentence)
+            current = carried
+            length = sum(len(sentence) + 1 for sentence in current)
+        current.append(piece)
+        length += len(piece) + 1
+    if current:
+        passages.append(' '.join(current))
+    return passages
+
+
+def passage_rows(answer):
+    """(position, text, search terms) of each passage of an answer; the terms are analyze() of the text alone"""
+    return [
+        (position, text, ' '.join(analyze(text)))
+        for position, text in enumerate(split_passages(answer))
+    ]
@@ -0,0 +1,86 @@
+from collections import defaultdict
+
+import numpy as np
+
+from .text import words
+
+
+def trigrams(text):
+    """Character trigrams of the words of text (stopwords dropped), padded at word edges"""
+    grams = set()
+    for word in words(text):
+        padded = f"  {word} "
+        grams.update(padded[start:start + 3] for start in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    Typo tolerant lookup: keys scored by the trigrams they share with a query.
+
+    Each trigram maps to an array of key positions, so a search is one
+    bincount over the posting arrays of the query's trigrams. Removed keys
+    keep their position with an infinite size, which scores zero.
+    """
+
+    def __init__(self, items):
+        self.keys = []
+        self.positions = {}
+        sizes = []
+        postings = defaultdict(list)
+        for key, text in items:
+            grams = trigrams(text)
+            if not grams:
+                continue
+            self.positions[key] = len(self.keys)
+            for gram in grams:
+                postings[gram].append(len(self.keys))
+            self.keys.append(key)
+            sizes.append(len(grams))
+        self.sizes = np.asarray(sizes, dtype=np.float32)
+        self.postings = {gram: np.asarray(positions, dtype=np.int32) for gram, positions in postings.items()}
+
+    def add(self, key, text):
+        """Index a new key, or re-index one whose text changed"""
+        self.remove(key)
+        grams = trigrams(text)
+        if not grams:
+            return
+        position = len(self.keys)
+        # Sizes grow before the postings, so a concurrent search can cut the
+        # positions it counts to the sizes it read
+        self.sizes = np.append(self.sizes, np.float32(len(grams)))
+        self.keys.append(key)
+        self.positions[key] = position
+        for gram in grams:
+            self.postings[gram] = np.append(self.postings.get(gram, np.empty(0, dtype=np.int32)), np.int32(position))
+
+    def remove(self, key):
+        position = self.positions.pop(key, None)
+        if position is not None:
+            self.sizes[position] = np.inf
+
+    def search(self, text, k=5, threshold=0.3, metric='dice'):
+        """Return up to k (key, similarity) pairs scoring at least threshold, best first"""
+        query_grams = trigrams(text)
+        grams = [gram for gram in query_grams if gram in self.postings]
+        if not grams:
+            return []
+        query_size = len(query_grams)
+        sizes = self.sizes
+        shared = np.bincount(
+            np.concatenate([self.postings[gram] for gram in grams]), minlength=len(sizes)
+        )[:len(sizes)].astype(np.float32)
+        if metric == 'jaccard':
+            scores = shared / (query_size + sizes - shared)
+        else:
+            scores = 2 * shared / (query_size + sizes)
+
+        candidates = np.flatnonzero(scores >= threshold)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(self.keys[position], float(scores[position])) for position in candidates]
+
+    def __len__(self):
+        return len(self.positions)
@@ -0,0 +1,211 @@
+import heapq
+import logging
+import math
+import time
+from operator import itemgetter
+
+import numpy as np
+from django.conf import settings
+
+from .embeddings import EMBEDDING_DIM
+from .kb_sync import LiveIndex
+from .models import KnowledgeBaseEntry
+
+logger = logging.getLogger(__name__)
+
+# Coarse partitioning kicks in at this many entries; below it every row is scored
+IVF_MIN_ENTRIES = getattr(settings, 'ASSISTANT_KB_IVF_MIN_ENTRIES', 20000)
+# Partitions searched per query when partitioning is on
+IVF_PROBES = getattr(settings, 'ASSISTANT_KB_IVF_PROBES', 8)
+
+# Rows scored per matrix product while partitioning, to bound memory
+CHUNK_ROWS = 8192
+# Rows per partition used to train the partition centroids
+SAMPLE_PER_LIST = 64
+# Entries added or edited since the build are scored without partitioning;
+# past this many (or a twentieth of the index) the index is rebuilt
+MAX_ADDED_ROWS = 1000
+
+
+def _top_k(scores, k):
+    """Positions of the k highest scores, best first"""
+    if len(scores) > k:
+        top = np.argpartition(-scores, k)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+class VectorIndex:
+    """
+    Cosine similarity search over a contiguous float32 matrix of unit vectors.
+
+    With n_lists > 0 the rows are clustered by spherical k-means (IVF) and
+    stored grouped by cluster, so a query scores only the rows of the n_probe
+    clusters closest to it.
+
+    Entries added after the build go to a small separate matrix that every
+    search scores in full; removed rows are masked out.
+    """
+
+    def __init__(self, ids, matrix, n_lists=0, n_probe=IVF_PROBES):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.n_probe = n_probe
+        self.centroids = None
+        self.offsets = None
+        if n_lists and len(self.ids) > n_lists:
+            self._partition(n_lists)
+        self.positions = {entry_id: position for position, entry_id in enumerate(self.ids.tolist())}
+        self.deleted = np.zeros(len(self.ids), dtype=bool)
+        self.removed = 0
+        # (ids, matrix) of the rows added since the build, replaced as a pair
+        self.added = (np.empty(0, dtype=np.int64), np.empty((0, self.matrix.shape[1]), dtype=np.float32))
+
+    @staticmethod
+    def _assign(matrix, centroids):
+        return np.concatenate([
+            np.argmax(matrix[start:start + CHUNK_ROWS] @ centroids.T, axis=1)
+            for start in range(0, len(matrix), CHUNK_ROWS)
+        ])
+
+    def _partition(self, n_lists, iterations=10):
+        rng = np.random.default_rng(0)
+        # Centroids are trained on a sample, then every row is assigned once
+        sample_size = min(len(self.matrix), n_lists * SAMPLE_PER_LIST)
+        sample = self.matrix[rng.choice(len(self.matrix), sample_size, replace=False)]
+        centroids = sample[:n_lists].copy()
+        for _ in range(iterations):
+            assignment = self._assign(sample, centroids)
+            order = np.argsort(assignment, kind='stable')
+            filled, starts = np.unique(assignment[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[filled] = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        assignment = self._assign(self.matrix, centroids)
+        order = np.argsort(assignment, kind='stable')
+        self.matrix = np.ascontiguousarray(self.matrix[order])
+        self.ids = self.ids[order]
+        self.centroids = centroids
+        self.offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+
+    def add(self, entry_id, vector):
+        """Index a new entry, or replace the vector of one that changed"""
+        self.remove(entry_id)
+        ids, matrix = self.added
+        self.added = (np.append(ids, entry_id), np.vstack([matrix, vector]).astype(np.float32))
+
+    def remove(self, entry_id):
+        position = self.positions.pop(entry_id, None)
+        if position is not None:
+            self.deleted[position] = True
+            self.removed += 1
+        ids, matrix = self.added
+        keep = ids != entry_id
+        if not keep.all():
+            self.added = (ids[keep], matrix[keep])
+
+    def search(self, vector, k=5):
+        """Return up to k (id, similarity) pairs, best first"""
+        if self.centroids is None:
+            ids = self.ids
+            scores = self.matrix @ vector
+            deleted = self.deleted
+        else:
+            probes = _top_k(self.centroids @ vector, self.n_probe)
+            rows = np.concatenate([np.arange(self.offsets[probe], self.offsets[probe + 1]) for probe in probes])
+            ids = self.ids[rows]
+            scores = self.matrix[rows] @ vector
+            deleted = self.deleted[rows]
+        if self.removed:
+            scores[deleted] = -np.inf
+        top = _top_k(scores, k)
+        results = list(zip(ids[top].tolist(), scores[top].tolist()))
+
+        added_ids, added = self.added
+        if len(added_ids):
+            added_scores = added @ vector
+            top = _top_k(added_scores, k)
+            results = heapq.nlargest(
+                k, results + list(zip(added_ids[top].tolist(), added_scores[top].tolist())), key=itemgetter(1)
+            )
+        return [(entry_id, score) for entry_id, score in results if score > -np.inf]
+
+    def search_many(self, vectors, k=5):
+        """Exact top k for a batch of query vectors with one matrix product"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        added_ids, added = self.added
+        ids = np.concatenate([self.ids, added_ids])
+        scores = np.hstack([vectors @ self.matrix.T, vectors @ added.T])
+        if self.removed:
+            scores[:, np.flatnonzero(self.deleted)] = -np.inf
+        results = []
+        for row in scores:
+            top = _top_k(row, k)
+            results.append([
+                (entry_id, score) for entry_id, score in zip(ids[top].tolist(), row[top].tolist()) if score > -np.inf
+            ])
+        return results
+
+    def __len__(self):
+        return len(self.positions) + len(self.added[0])
+
+
+def stored_vector(embedding):
+    """Vector of a stored embedding, or None when it is missing or of another size"""
+    if embedding is None or len(embedding) != EMBEDDING_DIM * 4:
+        return None
+    return np.frombuffer(bytes(embedding), dtype=np.float32)
+
+
+def build_vector_index():
+    """
+    Load every stored embedding into one matrix. Embeddings are written with
+    the entries, so entries without one (or of another size) are left out
+    until `manage.py reindex_kb` embeds them.
+    """
+    started = time.perf_counter()
+    ids = []
+    blobs = []
+    missing = 0
+    for entry_id, embedding in KnowledgeBaseEntry.objects.values_list('id', 'embedding').iterator():
+        if stored_vector(embedding) is None:
+            missing += 1
+            continue
+        ids.append(entry_id)
+        blobs.append(bytes(embedding))
+    matrix = np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(len(ids), EMBEDDING_DIM)
+    n_lists = int(math.sqrt(len(ids))) if len(ids) >= IVF_MIN_ENTRIES else 0
+    index = VectorIndex(ids, matrix, n_lists=n_lists)
+    logger.info("KB vectors: %d entries, %d partitions in %.0f ms",
+                len(index), n_lists, (time.perf_counter() - started) * 1000)
+    if missing:
+        logger.warning("KB vectors: %d entries have no embedding, run manage.py reindex_kb", missing)
+    return index
+
+
+def update_vector_index(index, entry_ids):
+    """Reload or drop the given entries; rebuilds once too many rows sit outside the partitions"""
+    found = set()
+    for entry_id, embedding in KnowledgeBaseEntry.objects.filter(id__in=entry_ids).values_list('id', 'embedding'):
+        vector = stored_vector(embedding)
+        if vector is not None:
+            index.add(entry_id, vector)
+            found.add(entry_id)
+    for entry_id in entry_ids - found:
+        index.remove(entry_id)
+    if len(index.added[0]) > max(MAX_ADDED_ROWS, len(index) // 20):
+        return build_vector_index()
+    return index
+
+
+_index = LiveIndex(build_vector_index, update_vector_index)
+
+
+def get_vector_index():
+    """Return the process wide vector index, up to date with the change log"""
+    return _index.get()
+
+
+def reset_vector_index():
+    _index.reset()
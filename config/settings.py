@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -132,3 +133,106 @@ ALLOWED_HOSTS = ['*']
 
 
 CORS_ALLOW_ALL_ORIGINS = True
+
+
+# University assistant
+# Language model backend. Use 'ai.llm.StubBackend' (with optional 'LATENCY'
+# seconds and canned 'RESPONSES') to run the assistant offline; it is also the
+# default when GEMINI_API_KEY is not set.
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
+ASSISTANT_LLM = {
+    'BACKEND': os.environ.get(
+        'ASSISTANT_LLM_BACKEND', 'ai.llm.GeminiBackend' if GEMINI_API_KEY else 'ai.llm.StubBackend'
+    ),
+    'MODEL': os.environ.get('ASSISTANT_LLM_MODEL', 'gemini-1.5-flash'),
+    'API_KEY': GEMINI_API_KEY,
+    'TIMEOUT': 30,
+    'LATENCY': float(os.environ.get('ASSISTANT_LLM_LATENCY', 0)),
+}
+# Local intent classifier confidence needed to skip the Gemini intent call
+ASSISTANT_LOCAL_INTENT_THRESHOLD = 0.7
+# Seconds before the entity gazetteer is rebuilt from the university tables
+ASSISTANT_GAZETTEER_TTL = 300
+# Run the knowledge base search alongside the structured handler in the async view
+ASSISTANT_SPECULATIVE_KB_SEARCH = True
+# Final answer cache: maximum entries per process and seconds to live
+ASSISTANT_RESPONSE_CACHE_SIZE = 1024
+ASSISTANT_RESPONSE_CACHE_TTL = 900
+# Answer prompt budget: rows per intent (see ai/prompt_budget.py for the
+# defaults), characters kept of long text fields and a token ceiling
+ASSISTANT_PROMPT_MAX_ROWS = {}
+ASSISTANT_PROMPT_TEXT_CHARS = 400
+ASSISTANT_PROMPT_MAX_TOKENS = 3000
+# Knowledge base search: 'fts5' ranks inside SQLite with the full-text table of
+# migration ai 0003, 'bm25' with an in-memory inverted index built on first use
+# (also used by 'fts5' on other databases), 'vector' with hashed embeddings,
+# 'hybrid' fuses the full-text and vector rankings, 'orm' falls back to LIKE queries
+ASSISTANT_KB_BACKEND = 'fts5'
+ASSISTANT_KB_BM25_K1 = 1.5
+ASSISTANT_KB_BM25_B = 0.75
+# Embedding size of the vector index and the entry count from which it is
+# partitioned (IVF), searching only the closest ASSISTANT_KB_IVF_PROBES partitions
+ASSISTANT_KB_EMBEDDING_DIM = 512
+ASSISTANT_KB_IVF_MIN_ENTRIES = 20000
+ASSISTANT_KB_IVF_PROBES = 8
+# Seconds knowledge base search results stay cached, and results that found
+# nothing (which would otherwise repeat the keyword call on every miss)
+ASSISTANT_KB_CACHE_TTL = 3600
+ASSISTANT_KB_NEGATIVE_CACHE_TTL = 60
+# Character trigram (Dice) similarity needed for typo tolerant matches: knowledge
+# base questions when nothing else matched (or ranked first from FUZZY_CLOSE on),
+# and entity names in the local classifier
+ASSISTANT_KB_FUZZY_THRESHOLD = 0.4
+ASSISTANT_KB_FUZZY_CLOSE = 0.75
+ASSISTANT_ENTITY_FUZZY_THRESHOLD = 0.6
+# Long knowledge base answers are stored as overlapping passages of about
+# PASSAGE_CHARS characters; searches answer with the best PASSAGES_PER_ENTRY
+ASSISTANT_KB_PASSAGE_CHARS = 400
+ASSISTANT_KB_PASSAGE_OVERLAP = 100
+ASSISTANT_KB_PASSAGES_PER_ENTRY = 1
+# Entry edits reach the in-memory search indexes through a change log in the
+# default cache (share it, e.g. Redis or Memcached, between worker processes).
+# An index more than MAX_INCREMENTAL changes or CHANGE_LOG_TTL seconds behind is rebuilt.
+ASSISTANT_KB_CHANGE_LOG_TTL = 86400
+ASSISTANT_KB_MAX_INCREMENTAL = 1000
+# Type-ahead suggestions (/assistant/suggest/?q=) are served from memory; the
+# index is rebuilt in the background every SUGGEST_TTL seconds
+ASSISTANT_SUGGEST_TTL = 300
+ASSISTANT_SUGGEST_LIMIT = 8
+# Conversation context per client: seconds kept after the last request, the
+# exchanges kept (older ones drop out), remembered entities and characters
+# kept of each stored answer
+ASSISTANT_CONTEXT_TTL = 3600
+ASSISTANT_CONTEXT_TURNS = 3
+ASSISTANT_CONTEXT_USER_DATA = 20
+ASSISTANT_CONTEXT_RESPONSE_CHARS = 600
+# Prompts carry a rolling conversation summary, refreshed in the background
+# every SUMMARY_EVERY exchanges (fewer than CONTEXT_TURNS), plus the last
+# VERBATIM_TURNS exchanges
+ASSISTANT_SUMMARY_EVERY = 2
+ASSISTANT_SUMMARY_CHARS = 600
+ASSISTANT_CONTEXT_VERBATIM_TURNS = 2
+# Cache shared by every worker process (search results, the knowledge base
+# change log) when REDIS_URL is set, which needs the redis package; otherwise
+# each process keeps its own in memory
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Where conversation contexts live, shared by every worker: a SQLite file
+# (ai.context_store.SQLiteContextStore, one host), a Redis-protocol server
+# (ai.context_store.RedisContextStore with a redis:// LOCATION, many hosts)
+# or the default cache (ai.context_store.CacheContextStore)
+ASSISTANT_CONTEXT_STORE = {
+    'BACKEND': os.environ.get('ASSISTANT_CONTEXT_BACKEND', 'ai.context_store.SQLiteContextStore'),
+    'LOCATION': os.environ.get('ASSISTANT_CONTEXT_LOCATION', str(BASE_DIR / 'assistant_context.sqlite3')),
+}
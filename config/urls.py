@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from university import views
-from ai.views import university_assistant
+from ai.views import university_assistant, university_assistant_async, assistant_cache_stats, assistant_suggest
 from django.contrib import admin
 
 # Create a router and register our viewsets with it
@@ -63,4 +63,7 @@ urlpatterns = [
 urlpatterns += [
     path('api-auth/', include('rest_framework.urls')),
     path('assistant/', university_assistant, name='university-assistant'),
+    path('assistant/async/', university_assistant_async, name='university-assistant-async'),
+    path('assistant/cache-stats/', assistant_cache_stats, name='university-assistant-cache-stats'),
+    path('assistant/suggest/', assistant_suggest, name='university-assistant-suggest'),
 ]
\ No newline at end of file